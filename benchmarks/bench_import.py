@@ -0,0 +1,55 @@
+"""Import-time benchmark for the raw2fits modules.
+
+Imports each module in a fresh interpreter, reports the time taken and checks that
+none of the heavy dependencies (numba, OpenCV, rawpy, astropy) were imported with it;
+they should only be loaded when a debayer engine, raw file or FITS file is used.
+Exits with status 1 on a regression, so it can run as a CI check.
+
+    python benchmarks/bench_import.py --repeat 5 --budget 0.5
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+MODULES = ["raw2fits", "raw2fits.instrument", "raw2fits.debayer", "raw2fits.fitsio", "raw2fits.raw", "raw2fits.image", "raw2fits.batch"]
+HEAVY_MODULES = ["numba", "cv2", "rawpy", "astropy"]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def time_import(module):
+    """Import module in a fresh interpreter and return (seconds, heavy modules it imported)."""
+    probe = _PROBE.format(module=module, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, "-c", probe], check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    return result["seconds"], result["heavy"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=0.5, help="maximum import time of any module, in seconds")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<20} {'seconds':>10}  heavy imports")
+    for module in MODULES:
+        runs = [time_import(module) for _ in range(args.repeat)]
+        best = min(seconds for seconds, _ in runs)
+        heavy = runs[0][1]
+        failed |= best > args.budget or bool(heavy)
+        print(f"{module:<20} {best:>10.3f}  {', '.join(heavy) or '-'}")
+    if failed:
+        print(f"FAILED: a module imported a heavy dependency or took longer than {args.budget} s")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Benchmark suite for the decode, debayer and FITS-write hot paths.
+
+Every benchmark runs in a fresh process on synthetic data (see synthetic.py) for each
+CFA phase and frame size, and records the best time, the throughput in megapixels per
+second, the peak resident memory and, for the numba kernel, the JIT time (compiling, or
+loading the kernel from numba's cache; use --cold-jit to always compile). The results
+are written to JSON with the git commit they were measured on, and --compare prints
+the change between two result files:
+
+    python benchmarks/bench_suite.py --sizes 12 24 50 100 -o results.json
+    python benchmarks/bench_suite.py --compare baseline.json results.json
+
+The decode, exif and save_fits benchmarks need pidng to write the synthetic DNG files.
+"""
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from synthetic import BAYER_PATTERNS, synthetic_mosaic, write_dng
+
+
+def _debayer(module, function, **options):
+    """Benchmark of a debayer function on the in-memory mosaic."""
+    def setup(mosaic, bayer_pattern, raw_path, tmpdir):
+        function_ = getattr(importlib.import_module(module), function)
+        return lambda: function_(mosaic, bayer_pattern, **options)
+    return setup
+
+def _decode(mosaic, bayer_pattern, raw_path, tmpdir):
+    import rawpy
+
+    def run():
+        with rawpy.imread(raw_path) as raw:
+            return np.array(raw.raw_image_visible)
+    return run
+
+def _exif(mosaic, bayer_pattern, raw_path, tmpdir):
+    from raw2fits.raw import read_exif
+    return lambda: read_exif(raw_path)
+
+def _save_fits(compress=None):
+    """Benchmark of Image.save_fits (header and write) on an image that is already debayered."""
+    def setup(mosaic, bayer_pattern, raw_path, tmpdir):
+        from raw2fits.image import Image
+
+        img = Image(raw_path, debayer_method="Bilinear")
+        img.debayer()
+        return lambda: img.save_fits("LIGHT", path=tmpdir, compress=compress)
+    return setup
+
+# name -> (setup(mosaic, bayer_pattern, raw_path, tmpdir) returning the function to time, needs a raw file)
+BENCHMARKS = {
+    "vng_numba": (_debayer("raw2fits.debayer_numba", "debayer_VNG"), False),
+    "vng_numpy": (_debayer("raw2fits.debayer_numpy", "debayer_VNG"), False),
+    "bilinear_opencv": (_debayer("raw2fits.debayer_opencv", "debayer_bilinear"), False),
+    "bilinear_numpy": (_debayer("raw2fits.debayer_numpy", "debayer_bilinear"), False),
+    "edge_aware_opencv": (_debayer("raw2fits.debayer_opencv", "debayer_edge_aware"), False),
+    "superpixel_numpy": (_debayer("raw2fits.debayer_numpy", "debayer_superpixel"), False),
+    "decode": (_decode, True),
+    "exif": (_exif, True),
+    "save_fits": (_save_fits(), True),
+    "save_fits_rice": (_save_fits("RICE_1"), True),
+}
+JIT_BENCHMARKS = ("vng_numba",)
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024 # kB on Linux
+
+def run_benchmark(name, megapixels, bayer_pattern, repeat, raw_path=None, n_threads=None):
+    """Run one benchmark in this process and return its result record."""
+    setup, _ = BENCHMARKS[name]
+    if name == "vng_numba" and n_threads is not None:
+        setup = _debayer("raw2fits.debayer_numba", "debayer_VNG", n_threads=n_threads)
+    mosaic = synthetic_mosaic(megapixels)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        run = setup(mosaic, bayer_pattern, raw_path, tmpdir)
+        rss_before = _peak_rss_mb()
+        timings = []
+        for _ in range(repeat + 1): # The first call includes JIT compilation and cold caches
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+    best = min(timings[1:])
+    return {
+        "benchmark": name,
+        "bayer_pattern": bayer_pattern,
+        "megapixels": round(mosaic.size/1e6, 2),
+        "shape": list(mosaic.shape),
+        "best_seconds": best,
+        "median_seconds": float(np.median(timings[1:])),
+        "first_call_seconds": timings[0],
+        "jit_seconds": max(timings[0] - best, 0.0) if name in JIT_BENCHMARKS else None,
+        "mp_per_s": mosaic.size/1e6/best,
+        "rss_before_mb": rss_before,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+def _run_worker(spec, cold_jit):
+    """Run a benchmark in a fresh interpreter, so that peak RSS and JIT time are its own."""
+    env = dict(os.environ)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        if cold_jit:
+            env["NUMBA_CACHE_DIR"] = cache_dir
+        process = subprocess.run([sys.executable, __file__, "--worker", json.dumps(spec)], capture_output=True, text=True, env=env)
+    if process.returncode != 0:
+        raise RuntimeError(f"{spec['name']} failed:\n{process.stderr}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+def _git(*args):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        return subprocess.run(["git", *args], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment():
+    """Describe the code and machine the results were measured on."""
+    import numba
+    import raw2fits
+
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "raw2fits": raw2fits.__version__,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "numba": numba.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def compare(old_path, new_path):
+    """Print the throughput and peak memory of the benchmarks in two result files."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"old: {old['commit']} ({old['date']}), new: {new['commit']} ({new['date']})")
+    baseline = {(r["benchmark"], r["bayer_pattern"], r["megapixels"]): r for r in old["results"]}
+    print(f"{'benchmark':<18} {'CFA':<5} {'MP':>6} {'old MP/s':>10} {'new MP/s':>10} {'speedup':>8} {'old MB':>8} {'new MB':>8}")
+    for result in new["results"]:
+        before = baseline.get((result["benchmark"], result["bayer_pattern"], result["megapixels"]))
+        if before is None:
+            continue
+        print(f"{result['benchmark']:<18} {result['bayer_pattern']:<5} {result['megapixels']:>6.1f} {before['mp_per_s']:>10.2f} "
+              f"{result['mp_per_s']:>10.2f} {result['mp_per_s']/before['mp_per_s']:>8.2f} {before['peak_rss_mb']:>8.0f} {result['peak_rss_mb']:>8.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--benchmarks", nargs="+", default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    parser.add_argument("--sizes", nargs="+", type=float, default=[12, 24, 50, 100], help="megapixels (default: 12 24 50 100)")
+    parser.add_argument("--patterns", nargs="+", default=list(BAYER_PATTERNS), choices=BAYER_PATTERNS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None, help="threads of the numba kernel (default: all cores)")
+    parser.add_argument("--cold-jit", action="store_true", help="compile the numba kernels in every run instead of loading them from the cache")
+    parser.add_argument("-o", "--output", default=None, help="JSON file to write the results to")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(run_benchmark(**json.loads(args.worker))))
+        return
+    if args.compare is not None:
+        compare(*args.compare)
+        return
+
+    results = []
+    print(f"{'benchmark':<18} {'CFA':<5} {'MP':>6} {'seconds':>9} {'MP/s':>9} {'JIT s':>7} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        raw_files = {} # Synthetic DNG files, written once per size and pattern
+        for megapixels in args.sizes:
+            for bayer_pattern in args.patterns:
+                for name in args.benchmarks:
+                    raw_path = None
+                    if BENCHMARKS[name][1]:
+                        if (megapixels, bayer_pattern) not in raw_files:
+                            raw_files[megapixels, bayer_pattern] = write_dng(os.path.join(tmpdir, f"{megapixels}_{bayer_pattern}"),
+                                                                             synthetic_mosaic(megapixels), bayer_pattern)
+                        raw_path = raw_files[megapixels, bayer_pattern]
+                    spec = {"name": name, "megapixels": megapixels, "bayer_pattern": bayer_pattern, "repeat": args.repeat,
+                            "raw_path": raw_path, "n_threads": args.threads}
+                    result = _run_worker(spec, args.cold_jit)
+                    results.append(result)
+                    jit = f"{result['jit_seconds']:>7.2f}" if result["jit_seconds"] is not None else f"{'-':>7}"
+                    print(f"{name:<18} {bayer_pattern:<5} {result['megapixels']:>6.1f} {result['best_seconds']:>9.3f} "
+                          f"{result['mp_per_s']:>9.2f} {jit} {result['peak_rss_mb']:>8.0f}")
+            for path in [path for key, path in raw_files.items() if key[0] == megapixels]:
+                os.remove(path) # Keep at most one size of DNG files on disk
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({**environment(), "results": results}, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Scaling benchmark for the parallel VNG kernel.
+
+Debayers a synthetic RGGB mosaic with an increasing number of threads and reports
+the throughput for each thread count. No camera files are needed.
+
+    python benchmarks/bench_threads.py --megapixels 24 --repeat 3
+"""
+import argparse
+import time
+
+import numba as nb
+
+from raw2fits.debayer_numba import debayer_VNG, warmup
+from synthetic import synthetic_mosaic
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megapixels", type=float, default=24.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-threads", type=int, default=nb.config.NUMBA_NUM_THREADS)
+    args = parser.parse_args()
+
+    bayer_img = synthetic_mosaic(args.megapixels)
+    megapixels = bayer_img.size/1e6
+    warmup()
+
+    thread_counts = sorted({1, args.max_threads} | {2**k for k in range(1, 8) if 2**k < args.max_threads})
+    baseline = None
+    print(f"{'threads':>8} {'seconds':>10} {'MP/s':>10} {'speedup':>10}")
+    for n_threads in thread_counts:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            debayer_VNG(bayer_img, "RGGB", n_threads=n_threads)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        baseline = best if baseline is None else baseline
+        print(f"{n_threads:>8} {best:>10.3f} {megapixels/best:>10.2f} {baseline/best:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
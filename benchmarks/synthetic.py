@@ -0,0 +1,60 @@
+"""Synthetic test data for the benchmarks, so that no camera files are needed.
+
+Mosaics are random 14-bit values in a 3:2 frame. Raw files are written as uncompressed
+DNG with pidng (pip install pidng), which is only needed by the decode, EXIF and
+save_fits benchmarks.
+"""
+import numpy as np
+
+
+BAYER_PATTERNS = ("RGGB", "BGGR", "GRBG", "GBRG")
+
+
+def mosaic_shape(megapixels):
+    """Return the (height, width) of a 3:2 mosaic of about megapixels, both even."""
+    width = int(np.sqrt(megapixels*1e6*3/2)) // 2 * 2
+    height = int(width*2/3) // 2 * 2
+    return height, width
+
+def synthetic_mosaic(megapixels, seed=0):
+    """Return a random uint16 mosaic of about megapixels with 14-bit values."""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 16384, size=mosaic_shape(megapixels), dtype=np.uint16)
+
+def write_dng(path, mosaic, bayer_pattern="RGGB"):
+    """Write a mosaic to an uncompressed 16-bit DNG file with typical EXIF tags, and return its path.
+
+    path is given without the .dng extension, which pidng appends.
+    """
+    from pidng.core import RAW2DNG, DNGTags, Tag
+    from pidng.defs import CalibrationIlluminant, CFAPattern, DNGVersion, Orientation, PhotometricInterpretation
+
+    height, width = mosaic.shape
+    tags = DNGTags()
+    tags.set(Tag.ImageWidth, width)
+    tags.set(Tag.ImageLength, height)
+    tags.set(Tag.TileWidth, width)
+    tags.set(Tag.TileLength, height)
+    tags.set(Tag.Orientation, Orientation.Horizontal)
+    tags.set(Tag.PhotometricInterpretation, PhotometricInterpretation.Color_Filter_Array)
+    tags.set(Tag.SamplesPerPixel, 1)
+    tags.set(Tag.BitsPerSample, 16)
+    tags.set(Tag.CFARepeatPatternDim, [2, 2])
+    tags.set(Tag.CFAPattern, getattr(CFAPattern, bayer_pattern))
+    tags.set(Tag.BlackLevel, 0)
+    tags.set(Tag.WhiteLevel, 65535)
+    tags.set(Tag.ColorMatrix1, [[1, 1], [0, 1], [0, 1], [0, 1], [1, 1], [0, 1], [0, 1], [0, 1], [1, 1]])
+    tags.set(Tag.CalibrationIlluminant1, CalibrationIlluminant.D65)
+    tags.set(Tag.AsShotNeutral, [[1, 1], [1, 1], [1, 1]])
+    tags.set(Tag.Make, "raw2fits")
+    tags.set(Tag.Model, "Synthetic")
+    tags.set(Tag.DNGVersion, DNGVersion.V1_4)
+    tags.set(Tag.DNGBackwardVersion, DNGVersion.V1_2)
+    tags.set(Tag.ExposureTime, [[30, 1]])
+    tags.set(Tag.PhotographicSensitivity, [800])
+    tags.set(Tag.FocalLength, [[135, 1]])
+    tags.set(Tag.DateTime, "2024:01:02 03:04:05")
+    converter = RAW2DNG()
+    converter.options(tags, path="", compress=False)
+    converter.convert(mosaic, filename=path)
+    return f"{path}.dng"
@@ -1,2 +1,17 @@
 __version__ = "1.0.2"
-__author__ = "Jamie Chang"
\ No newline at end of file
+__author__ = "Jamie Chang"
+
+# The public API is imported on first access, so that `import raw2fits` does not load numpy,
+# numba, OpenCV, rawpy or astropy before they are needed (e.g. in short-lived worker processes).
+_LAZY_ATTRIBUTES = {
+    "Image": "raw2fits.image",
+    "debayer_array": "raw2fits.debayer",
+    "read_raw": "raw2fits.raw",
+    "convert": "raw2fits.batch",
+}
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        import importlib
+        return getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    raise AttributeError(f"module 'raw2fits' has no attribute '{name}'")
@@ -0,0 +1,240 @@
+"""Batch conversion of raw files to FITS.
+
+Converts whole directories (or glob patterns) of raw files across a pool of worker
+processes. Also installed as the ``raw2fits`` console script:
+
+    raw2fits lights/*.CR2 -t LIGHT -o fits/ -j 8
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from raw2fits import instrument
+from raw2fits.debayer import backends
+from raw2fits.fitsio import COMPRESSION_TYPES
+from raw2fits.image import Image
+
+
+RAW_EXTENSIONS = (".cr2", ".cr3", ".nef", ".nrw", ".arw", ".dng", ".raf", ".orf", ".rw2", ".pef")
+
+BatchResult = namedtuple("BatchResult", ["path", "output", "seconds", "skipped", "error"])
+BatchResult.__doc__ = """Outcome of converting one file: seconds is the conversion time, error the message of a failed conversion."""
+
+
+def find_raw_files(inputs, extensions=RAW_EXTENSIONS):
+    """Expand files, directories and glob patterns into a sorted list of raw files.
+
+    Parameters
+    ----------
+    inputs : list of str
+        Paths to raw files, directories (searched non-recursively) or glob patterns.
+    extensions : tuple of str
+        Lower-case file extensions to accept.
+
+    Returns
+    -------
+    paths : list of str
+        Raw files found, without duplicates.
+
+    """
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = [os.path.join(item, name) for name in os.listdir(item)]
+        else:
+            candidates = glob.glob(item) or [item]
+        for candidate in candidates:
+            if os.path.isfile(candidate) and os.path.splitext(candidate)[1].lower() in extensions:
+                paths.add(candidate)
+            elif not os.path.exists(candidate):
+                raise FileNotFoundError(f"File {candidate} does not exist.")
+    return sorted(paths)
+
+def output_path(path, output_dir=None):
+    """Return the FITS path Image.save_fits writes for a raw file."""
+    file_extension = os.path.splitext(path)[1]
+    if output_dir is None:
+        return path.replace(file_extension, ".fits")
+    return os.path.join(output_dir, os.path.basename(path).replace(file_extension, ".fits"))
+
+def is_up_to_date(path, output):
+    """Return True if output exists and is newer than the raw file it was converted from."""
+    return os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(path)
+
+def convert_file(path, image_type="LIGHT", output_dir=None, debayer_method="VNG", n_threads=1, precision="float64", engine=None, calibration=None, compress=None, cache=None, sinks=(),
+                 binning=1, roi=None):
+    """Convert a single raw file to FITS. Runs in the worker processes of convert()."""
+    start = time.perf_counter()
+    output = output_path(path, output_dir)
+    try:
+        with instrument.sinks(*sinks):
+            img = Image(path, debayer_method=debayer_method, n_threads=n_threads, precision=precision, engine=engine, calibration=calibration, cache=cache,
+                        binning=binning, roi=roi)
+            img.save_fits(image_type, path=output_dir, compress=compress)
+    except Exception as e:
+        return BatchResult(path, output, time.perf_counter() - start, False, f"{type(e).__name__}: {e}")
+    return BatchResult(path, output, time.perf_counter() - start, False, None)
+
+def convert(paths, image_type="LIGHT", output_dir=None, debayer_method="VNG", workers=None, n_threads=1,
+            precision="float64", max_in_flight=None, overwrite=False, callback=None, engine=None, calibration=None, compress=None, cache=None,
+            sinks=(), binning=1, roi=None):
+    """Convert raw files to FITS in a pool of worker processes.
+
+    Parameters
+    ----------
+    paths : list of str
+        Raw files to convert, see find_raw_files.
+    image_type : str
+        "LIGHT", "DARK", "FLAT" or "BIAS", written to every output header.
+    output_dir : str, optional
+        Directory for the FITS files. If None, each file is written next to its raw file.
+    debayer_method : str
+        Debayering method, see raw2fits.debayer.debayer_array.
+    workers : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    n_threads : int
+        Number of debayer threads per worker.
+    precision : str
+        Floating point precision of the VNG kernel, "float64" or "float32".
+    max_in_flight : int, optional
+        Maximum number of files submitted to the pool at once. Every file in flight holds
+        a full frame in memory, so this bounds the memory used by the conversion.
+        Defaults to workers.
+    overwrite : bool
+        Convert files whose FITS output is already up to date.
+    callback : callable, optional
+        Called with each BatchResult as soon as it is available.
+    engine : str, optional
+        Preferred debayer implementation, see raw2fits.debayer.debayer_array.
+    calibration : str, optional
+        Path to master frames saved with raw2fits.calibration.Calibration.save, applied to every
+        frame before debayering. Each worker loads them once.
+    compress : str, optional
+        Write tile-compressed FITS files with this algorithm, e.g. "RICE_1", see raw2fits.fitsio.
+    cache : str, optional
+        Directory of a raw2fits.cache.DebayerCache shared by the workers: frames debayered before with
+        the same settings are loaded from it instead of being debayered again.
+    sinks : sequence of callables
+        Sinks of raw2fits.instrument registered in the workers while they convert a file. The workers
+        are separate processes, so sinks registered in this process do not see their events; these
+        are pickled, e.g. instrument.PrintSink() or instrument.JSONLinesSink(path).
+    binning : int
+        CFA binning factor applied before debayering, see raw2fits.image.Image.
+    roi : tuple of int, optional
+        (x, y, width, height) region of interest converted from every frame, see raw2fits.image.Image.
+
+    Returns
+    -------
+    results : list of BatchResult
+        One result per path, in completion order.
+
+    """
+    if image_type not in ["LIGHT", "DARK", "FLAT", "BIAS"]:
+        raise ValueError(f"Invalid image type: {image_type}")
+    workers = workers or os.cpu_count()
+    max_in_flight = max_in_flight or workers
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    results = []
+    def finish(result):
+        results.append(result)
+        if callback is not None:
+            callback(result)
+
+    pending = []
+    for path in paths:
+        output = output_path(path, output_dir)
+        if not overwrite and is_up_to_date(path, output):
+            finish(BatchResult(path, output, 0.0, True, None))
+        else:
+            pending.append(path)
+
+    # LibRaw uses OpenMP, which can deadlock in forked children, so the workers are spawned
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        in_flight = set()
+        for path in pending:
+            if len(in_flight) >= max_in_flight: # Wait for a slot before decoding another frame
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future.result())
+            in_flight.add(executor.submit(convert_file, path, image_type, output_dir, debayer_method, n_threads, precision, engine, calibration, compress, cache, sinks, binning, roi))
+        for future in wait(in_flight).done:
+            finish(future.result())
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="raw2fits", description="Convert camera raw images to FITS files.")
+    parser.add_argument("inputs", nargs="+", help="raw files, directories or glob patterns")
+    parser.add_argument("-t", "--image-type", default="LIGHT", choices=["LIGHT", "DARK", "FLAT", "BIAS"], help="type of exposure (default: LIGHT)")
+    parser.add_argument("-o", "--output-dir", default=None, help="directory for the FITS files (default: next to each raw file)")
+    parser.add_argument("-m", "--method", default="VNG", choices=list(backends()), help="debayering method (default: VNG)")
+    parser.add_argument("-e", "--engine", default=None, choices=sorted({engine for engines in backends().values() for engine in engines}),
+                        help="preferred debayer implementation (default: the method's default)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--threads", type=int, default=None, help="debayer threads per worker (default: 1, or all cores with --pipeline)")
+    parser.add_argument("--precision", default="float64", choices=["float64", "float32"], help="precision of the VNG kernel (default: float64)")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="maximum number of frames in memory at once (default: workers)")
+    parser.add_argument("--overwrite", action="store_true", help="convert files whose FITS output is already up to date")
+    parser.add_argument("--calibration", default=None, help="master frames to calibrate with, see raw2fits-calibrate")
+    parser.add_argument("--cache", default=None, help="directory to cache debayered images in, reused when converting again")
+    parser.add_argument("--bin", type=int, default=1, help="bin the Bayer mosaic by this factor before debayering (default: 1)")
+    parser.add_argument("--roi", type=int, nargs=4, default=None, metavar=("X", "Y", "WIDTH", "HEIGHT"),
+                        help="convert only this region of the mosaic, in unbinned pixels (default: whole frame)")
+    parser.add_argument("--compress", default=None, choices=COMPRESSION_TYPES, help="write tile-compressed FITS files (lossless, default: uncompressed)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the time, bytes and pixels of every stage of every file")
+    parser.add_argument("--trace", default=None, help="append the stages of every file to this file as JSON lines")
+    pipeline = parser.add_argument_group("pipelined mode", "overlap reading, debayering and writing in one process instead of using worker processes")
+    pipeline.add_argument("--pipeline", action="store_true", help="use the pipelined mode")
+    pipeline.add_argument("--readers", type=int, default=2, help="reader threads (default: 2)")
+    pipeline.add_argument("--writers", type=int, default=1, help="writer threads (default: 1)")
+    pipeline.add_argument("--queue-depth", type=int, default=2, help="capacity of the queues between the stages (default: 2)")
+    args = parser.parse_args(argv)
+
+    paths = find_raw_files(args.inputs)
+    print(f"Found {len(paths)} raw files")
+
+    def report(result):
+        if result.skipped:
+            print(f"Skipped {result.path} (up to date)")
+        elif result.error is not None:
+            print(f"Failed {result.path}: {result.error}")
+        else:
+            print(f"Converted {result.path} -> {result.output} in {result.seconds:.2f} s")
+
+    sinks = ([instrument.PrintSink()] if args.verbose else []) + ([instrument.JSONLinesSink(args.trace)] if args.trace else [])
+    start = time.perf_counter()
+    if args.pipeline:
+        from raw2fits.pipeline import convert_pipelined
+        with instrument.sinks(*sinks): # The pipeline runs in this process
+            results, stats = convert_pipelined(paths, image_type=args.image_type, output_dir=args.output_dir, debayer_method=args.method,
+                                               n_threads=args.threads, precision=args.precision, readers=args.readers, writers=args.writers,
+                                               queue_depth=args.queue_depth, overwrite=args.overwrite, callback=report, engine=args.engine,
+                                               calibration=args.calibration, compress=args.compress, cache=args.cache,
+                                               binning=args.bin, roi=args.roi)
+    else:
+        results = convert(paths, image_type=args.image_type, output_dir=args.output_dir, debayer_method=args.method,
+                          workers=args.workers, n_threads=args.threads or 1, precision=args.precision,
+                          max_in_flight=args.max_in_flight, overwrite=args.overwrite, callback=report, engine=args.engine,
+                          calibration=args.calibration, compress=args.compress, cache=args.cache, sinks=sinks,
+                          binning=args.bin, roi=args.roi)
+    elapsed = time.perf_counter() - start
+
+    converted = [result for result in results if not result.skipped and result.error is None]
+    n_skipped = sum(result.skipped for result in results)
+    n_failed = sum(result.error is not None for result in results)
+    rate = len(converted)/elapsed if elapsed > 0 else 0.0
+    print(f"Converted {len(converted)} frames in {elapsed:.1f} s ({rate:.2f} frames/s), {n_skipped} skipped, {n_failed} failed")
+    if args.pipeline:
+        for stage in stats:
+            print(f"  {stage.name:<8} {stage.workers} worker(s), {stage.items} frames, busy {stage.busy:.1f} s, "
+                  f"blocked {stage.blocked:.1f} s, utilization {stage.utilization:.0%}")
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,101 @@
+"""Content-addressed on-disk cache of debayered images.
+
+A debayered image is stored under a key derived from the contents of the raw file and
+everything that determines the result: the debayer method, the engine and the version of
+its output (see raw2fits.debayer.register_backend), the precision, the calibration and the
+raw2fits version. Re-running a conversion after a change that does
+not affect the pixels (e.g. to the header) loads the cached images instead of debayering
+again, and a renamed or copied raw file still hits the cache.
+"""
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from raw2fits import __version__
+from raw2fits.debayer import backend_version
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Return a hash of the contents of a file, read in chunks of chunk_size bytes."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def buffer_digest(buffer):
+    """Return the hash of the contents of a file that is already in memory, equal to its file_digest."""
+    return hashlib.blake2b(buffer, digest_size=20).hexdigest()
+
+
+class DebayerCache():
+    """Directory of debayered images, stored as .npy files named by their key.
+
+    Parameters
+    ----------
+    directory : str
+        Cache directory, created if it does not exist.
+
+    """
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def __repr__(self):
+        return f"DebayerCache(directory={self.directory})"
+
+    def key(self, digest, method, engine, precision, calibration=None, binning=1, roi=None):
+        """Return the key of a debayered image.
+
+        Parameters
+        ----------
+        digest : str
+            Hash of the raw file, see file_digest.
+        method, engine, precision : str
+            Debayer method, the engine that runs it and its precision. The version of the engine
+            (see raw2fits.debayer.backend_version) is part of the key, so a new version misses the cache.
+        calibration : Calibration, optional
+            Master frames applied before debayering.
+        binning : int
+            CFA binning factor applied before debayering.
+        roi : tuple of int, optional
+            (x, y, width, height) region of interest of the mosaic that was debayered.
+
+        """
+        fields = [__version__, backend_version(method, engine), digest, method, engine, precision, calibration.digest if calibration is not None else ""]
+        if binning != 1 or roi is not None: # Keys of full frames are unchanged
+            fields += [str(binning), ",".join(str(value) for value in roi) if roi is not None else ""]
+        return hashlib.blake2b("|".join(fields).encode(), digest_size=20).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def load(self, key):
+        """Return the cached image as a read-only memory map, or None if it is not cached."""
+        try:
+            return np.load(self._path(key), mmap_mode="r")
+        except FileNotFoundError:
+            return None
+
+    def store(self, key, image):
+        """Store an image. The file is written under a temporary name and renamed into place,
+        so that concurrent workers never read a partial file."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, image)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def clear(self):
+        """Remove all cached images."""
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy"):
+                os.remove(os.path.join(self.directory, name))
@@ -0,0 +1,301 @@
+"""Calibration of raw frames with master bias, dark and flat frames.
+
+Masters are built from raw files and applied to the Bayer mosaic before debayering,
+so calibrated FITS files come out of a single pass over the data:
+
+    python -m raw2fits.calibration --bias bias/ --dark darks/ --flat flats/ -o masters.fits
+    raw2fits lights/ -o fits/ --calibration masters.fits
+
+To combine more frames than fit in memory, the mosaics are spilled to a memory map on
+disk as they are read and combined a block of rows at a time, see raw2fits.combine.
+"""
+import argparse
+import functools
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from raw2fits import instrument
+from raw2fits.combine import COMBINE_METHODS, combine
+from raw2fits.raw import read_raw
+
+
+class Calibration():
+    """Master frames applied to a Bayer mosaic: calibrated = (raw - bias - dark) / flat + pedestal.
+
+    Parameters
+    ----------
+    bias : ndarray, optional
+        Master bias, float32 of the shape of the mosaic.
+    dark : ndarray, optional
+        Master dark with the bias removed if a bias is given (otherwise it includes the bias),
+        taken at the exposure time and temperature of the frames to calibrate.
+    flat : ndarray, optional
+        Master flat, normalized to 1 at each of the four sites of the Bayer tile (see normalize_flat).
+    bayer_pattern : str, optional
+        Bayer pattern of the mosaics the masters were built from. Mosaics with another pattern are refused.
+    pedestal : float
+        Offset added after calibration, so that noise below the bias level is not clipped at 0.
+
+    """
+    def __init__(self, bias=None, dark=None, flat=None, bayer_pattern=None, pedestal=0.0):
+        masters = [master for master in (bias, dark, flat) if master is not None]
+        if not masters:
+            raise ValueError("At least one of bias, dark and flat must be given.")
+        if any(master.shape != masters[0].shape for master in masters):
+            raise ValueError("The master frames must have the same shape.")
+        self.bias = bias
+        self.dark = dark
+        self.flat = flat
+        self.bayer_pattern = bayer_pattern
+        self.pedestal = pedestal
+        self.shape = masters[0].shape
+        self._digest = None
+
+    @property
+    def digest(self):
+        """Hash of the masters and pedestal, e.g. to key caches of calibrated results. The masters must not be modified."""
+        if self._digest is None:
+            digest = hashlib.blake2b(f"{self.calstat} {self.pedestal}".encode(), digest_size=20)
+            for master in (self.bias, self.dark, self.flat):
+                if master is not None:
+                    digest.update(np.ascontiguousarray(master, dtype=np.float32))
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    @property
+    def calstat(self):
+        """Calibration steps applied, for the CALSTAT header keyword: "B" (bias), "D" (dark) and "F" (flat)."""
+        return "".join(step for step, master in zip("BDF", (self.bias, self.dark, self.flat)) if master is not None)
+
+    def __repr__(self):
+        return f"Calibration(calstat={self.calstat}, shape={self.shape}, bayer_pattern={self.bayer_pattern})"
+
+    def apply(self, bayer_img, bayer_pattern=None, out=None, chunk_rows=256, region=None):
+        """Calibrate a Bayer mosaic.
+
+        Parameters
+        ----------
+        bayer_img : ndarray
+            2D uint16 Bayer mosaic.
+        bayer_pattern : str, optional
+            Bayer pattern of the mosaic, checked against the pattern of the masters.
+        out : ndarray, optional
+            uint16 array to write the result to. May be bayer_img itself, to calibrate in place.
+        chunk_rows : int
+            Rows converted to float at a time, which bounds the temporary memory.
+        region : tuple of slice, optional
+            (rows, columns) of the masters that bayer_img was cropped from, e.g. by
+            raw2fits.cfa.snap_roi. Only that region of the masters is applied.
+
+        Returns
+        -------
+        calibrated : ndarray
+            The calibrated mosaic, clipped to the uint16 range.
+
+        """
+        bias, dark, flat = self.bias, self.dark, self.flat
+        shape = self.shape
+        if region is not None:
+            bias, dark, flat = [master[region] if master is not None else None for master in (bias, dark, flat)] # Views
+            shape = next(master for master in (bias, dark, flat) if master is not None).shape
+        if bayer_img.shape != shape:
+            raise ValueError(f"Mosaic of shape {bayer_img.shape} does not match the master frames of shape {shape}.")
+        if None not in (bayer_pattern, self.bayer_pattern) and bayer_pattern != self.bayer_pattern:
+            raise ValueError(f"Bayer pattern {bayer_pattern} does not match the master frames ({self.bayer_pattern}).")
+        if out is None:
+            out = np.empty(shape, dtype=np.uint16)
+        for row_start in range(0, shape[0], chunk_rows):
+            rows = slice(row_start, row_start + chunk_rows)
+            value = bayer_img[rows].astype(np.float32)
+            if bias is not None:
+                value -= bias[rows]
+            if dark is not None:
+                value -= dark[rows]
+            if flat is not None:
+                value /= flat[rows]
+            if self.pedestal:
+                value += self.pedestal
+            np.clip(value, 0, 65535, out=value)
+            out[rows] = value # Truncates, like the debayer kernels
+        return out
+
+    def save(self, path, overwrite=True):
+        """Save the masters as a FITS file with one BIAS, DARK and/or FLAT image extension."""
+        from astropy.io import fits
+
+        primary = fits.PrimaryHDU()
+        primary.header["CALSTAT"] = (self.calstat, "Master frames in this file")
+        if self.bayer_pattern is not None:
+            primary.header["BAYERPAT"] = (self.bayer_pattern, "Bayer pattern of the master frames")
+        primary.header["PEDESTAL"] = (self.pedestal, "Offset added after calibration")
+        hdus = [fits.ImageHDU(master.astype(np.float32), name=name)
+                for name, master in (("BIAS", self.bias), ("DARK", self.dark), ("FLAT", self.flat)) if master is not None]
+        fits.HDUList([primary] + hdus).writeto(path, overwrite=overwrite)
+
+    @classmethod
+    def load(cls, path):
+        """Load masters saved with save()."""
+        from astropy.io import fits
+
+        with fits.open(path) as hdul:
+            header = hdul[0].header
+            masters = {name.lower(): np.array(hdul[name].data) for name in ("BIAS", "DARK", "FLAT") if name in hdul}
+            return cls(bayer_pattern=header.get("BAYERPAT"), pedestal=header.get("PEDESTAL", 0.0), **masters)
+
+@functools.lru_cache(maxsize=4)
+def _load_cached(path, mtime):
+    return Calibration.load(path)
+
+def load_calibration(calibration):
+    """Return calibration itself, or the masters saved at the path calibration. Loaded files are
+    cached per process, so batch workers read the masters only once."""
+    if calibration is None or isinstance(calibration, Calibration):
+        return calibration
+    if not os.path.exists(calibration):
+        raise FileNotFoundError(f"File {calibration} does not exist.")
+    return _load_cached(calibration, os.path.getmtime(calibration))
+
+
+def normalize_flat(flat):
+    """Normalize a flat in place to a median of 1 at each site of the 2x2 Bayer tile.
+
+    Each color is normalized separately, so that flat-fielding does not change the color
+    balance. Pixels that received no light, and sites of the tile whose median is not
+    positive (e.g. a channel left unexposed), are set to 1 (left uncorrected).
+    """
+    for y in range(2):
+        for x in range(2):
+            site = flat[y::2, x::2]
+            values = site[np.isfinite(site)] # Infinite and NaN values are reset to 1 below
+            median = np.median(values) if values.size else 0.0
+            if median > 0:
+                site /= median
+            else:
+                site[...] = 1.0
+    flat[~(np.isfinite(flat) & (flat > 0))] = 1.0
+    return flat
+
+def _combine_files(paths, method="median", sigma=3.0, offset=None, normalize=False, workdir=None):
+    """Combine the mosaics of raw files, with offset subtracted and, if normalize, each frame
+    scaled to a median of 1. Returns (master, Bayer pattern)."""
+    if not paths:
+        raise ValueError("No frames to combine.")
+    if method not in COMBINE_METHODS:
+        raise ValueError(f"Invalid method {method}. Must be one of {', '.join(COMBINE_METHODS)}.")
+    shape, bayer_pattern = None, None
+    scales = np.ones(len(paths), dtype=np.float32)
+    with tempfile.TemporaryDirectory(dir=workdir) as tmpdir:
+        stack, total = None, None
+        for index, path in enumerate(paths):
+            frame = read_raw(path)
+            if shape is None:
+                shape, bayer_pattern = frame.bayer_image.shape, frame.bayer_pattern
+            elif (frame.bayer_image.shape, frame.bayer_pattern) != (shape, bayer_pattern):
+                raise ValueError(f"{path} has a different size or Bayer pattern than {paths[0]}.")
+            if normalize:
+                sample = frame.bayer_image[::4, ::4].astype(np.float32) # Every 16th pixel is plenty for the level of a flat
+                if offset is not None:
+                    sample -= offset[::4, ::4]
+                scales[index] = 1.0/np.median(sample)
+            if method == "mean": # The mean is accumulated on the fly, nothing needs to be spilled
+                value = frame.bayer_image.astype(np.float32)
+                if offset is not None:
+                    value -= offset
+                value *= scales[index]
+                total = value if total is None else total + value
+                continue
+            if stack is None: # Spill the mosaics to disk, only one is held in memory at a time
+                stack = np.lib.format.open_memmap(os.path.join(tmpdir, "stack.npy"), mode="w+", dtype=np.uint16, shape=(len(paths), *shape))
+            stack[index] = frame.bayer_image
+            instrument.progress("read frames", index + 1, len(paths))
+        if method == "mean":
+            return total/len(paths), bayer_pattern
+        with instrument.span("combine", pixels=stack.size, bytes=stack.nbytes):
+            master = combine(stack, method=method, sigma=sigma, offset=offset, scales=scales if normalize else None)
+        del stack # Close the memory map before its directory is removed
+        return master, bayer_pattern
+
+def master_bias(paths, method="median", sigma=3.0, workdir=None):
+    """Combine bias frames into a master bias.
+
+    Parameters
+    ----------
+    paths : list of str
+        Raw bias frames.
+    method : str
+        "mean", "median" or "sigma_clip", see raw2fits.combine.combine.
+    sigma : float
+        Clipping threshold of "sigma_clip".
+    workdir : str, optional
+        Directory for the temporary stack of mosaics. Defaults to the system temporary directory.
+
+    Returns
+    -------
+    bias : ndarray
+        The master bias, float32.
+
+    """
+    return _combine_files(paths, method, sigma, workdir=workdir)[0]
+
+def master_dark(paths, bias=None, method="median", sigma=3.0, workdir=None):
+    """Combine dark frames into a master dark, with the master bias subtracted if given. See master_bias."""
+    return _combine_files(paths, method, sigma, offset=bias, workdir=workdir)[0]
+
+def master_flat(paths, bias=None, method="median", sigma=3.0, workdir=None):
+    """Combine flat frames into a master flat.
+
+    Each flat has the master bias subtracted and is scaled to a common level before
+    combining, and the result is normalized per Bayer site, see normalize_flat.
+    See master_bias for the parameters.
+    """
+    return normalize_flat(_combine_files(paths, method, sigma, offset=bias, normalize=True, workdir=workdir)[0])
+
+def build_calibration(bias=(), darks=(), flats=(), method="median", sigma=3.0, pedestal=0.0, workdir=None):
+    """Build a Calibration from raw bias, dark and flat frames, see master_bias for the parameters.
+    Any of the three lists may be empty."""
+    masters, patterns = {}, set()
+    if bias:
+        masters["bias"], pattern = _combine_files(bias, method, sigma, workdir=workdir)
+        patterns.add(pattern)
+    if darks:
+        masters["dark"], pattern = _combine_files(darks, method, sigma, offset=masters.get("bias"), workdir=workdir)
+        patterns.add(pattern)
+    if flats:
+        flat, pattern = _combine_files(flats, method, sigma, offset=masters.get("bias"), normalize=True, workdir=workdir)
+        masters["flat"] = normalize_flat(flat)
+        patterns.add(pattern)
+    if len(patterns) > 1:
+        raise ValueError(f"The calibration frames have different Bayer patterns: {', '.join(sorted(patterns))}.")
+    return Calibration(bayer_pattern=patterns.pop() if patterns else None, pedestal=pedestal, **masters)
+
+
+def main(argv=None):
+    from raw2fits.batch import find_raw_files
+
+    parser = argparse.ArgumentParser(prog="raw2fits-calibrate", description="Build master bias, dark and flat frames from raw files.")
+    parser.add_argument("--bias", nargs="+", default=[], help="raw bias frames, directories or glob patterns")
+    parser.add_argument("--dark", nargs="+", default=[], help="raw dark frames, directories or glob patterns")
+    parser.add_argument("--flat", nargs="+", default=[], help="raw flat frames, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="FITS file to save the masters to")
+    parser.add_argument("-m", "--method", default="median", choices=COMBINE_METHODS, help="combination method (default: median)")
+    parser.add_argument("--sigma", type=float, default=3.0, help="clipping threshold of sigma_clip (default: 3)")
+    parser.add_argument("--pedestal", type=float, default=0.0, help="offset added after calibration (default: 0)")
+    parser.add_argument("--workdir", default=None, help="directory for the temporary frame stack (default: system temp)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the progress and the time of every stage")
+    args = parser.parse_args(argv)
+
+    if not (args.bias or args.dark or args.flat):
+        parser.error("at least one of --bias, --dark and --flat is required")
+    with instrument.sinks(*([instrument.PrintSink()] if args.verbose else [])):
+        calibration = build_calibration(bias=find_raw_files(args.bias), darks=find_raw_files(args.dark), flats=find_raw_files(args.flat),
+                                        method=args.method, sigma=args.sigma, pedestal=args.pedestal, workdir=args.workdir)
+    calibration.save(args.output)
+    print(f"Saved {calibration} to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,212 @@
+"""Metadata catalog of raw archives.
+
+Scans the EXIF tags raw2fits writes to the FITS header (exposure, ISO, date, camera,
+lens and focal length) without decoding the image, the maker notes or the embedded
+thumbnail, and keeps them in an SQLite index keyed by path, modification time and size.
+Re-scanning an archive only reads the files that are new or changed, so sorting
+thousands of frames into sessions and calibration groups takes milliseconds:
+
+    raw2fits-catalog archive/ --db archive.sqlite --group-by model iso exposure_time
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from raw2fits.batch import find_raw_files
+from raw2fits.raw import observation_dates
+
+
+FrameInfo = namedtuple("FrameInfo", ["path", "mtime", "size", "exposure_time", "iso", "date_loc", "date_obs", "model", "lens",
+                                     "focal_length", "error"])
+FrameInfo.__doc__ = """Metadata of a raw file: exposure_time in seconds, dates in ISO format (date_obs in UTC if the EXIF
+has a time zone offset), focal_length in mm. Tags missing from the file are None, error is the message of a failed scan."""
+
+_PARALLEL_MIN_FILES = 64 # Below this, starting worker processes costs more than it saves
+
+
+def _tag(exif, name):
+    """An EXIF tag, from the EXIF sub-IFD or else from IFD0 (where e.g. DNG converters may put it), or None."""
+    return exif.get(f"EXIF {name}", exif.get(f"Image {name}"))
+
+def _number(exif, name):
+    """Value of a numeric (possibly rational) EXIF tag as a float, or None."""
+    tag = _tag(exif, name)
+    return None if tag is None else float(tag.values[0])
+
+def _text(exif, name):
+    tag = _tag(exif, name)
+    return None if tag is None else tag.printable.strip()
+
+def scan_file(path):
+    """Read the metadata of a raw file.
+
+    Only the EXIF directories are parsed: the image data, the maker notes and the
+    embedded thumbnail are skipped. A file that cannot be read or parsed gives a FrameInfo
+    with the error set instead of raising.
+
+    Parameters
+    ----------
+    path : str
+        Path to the raw image.
+
+    Returns
+    -------
+    info : FrameInfo
+        Metadata of the file.
+
+    """
+    import exifread
+
+    try:
+        stat = os.stat(path)
+    except OSError as e: # e.g. deleted since the directory was listed
+        return FrameInfo(path, None, None, *[None]*7, f"{type(e).__name__}: {e}")
+    try:
+        with open(path, "rb") as f:
+            exif = exifread.process_file(f, details=False, extract_thumbnail=False)
+        iso = _number(exif, "ISOSpeedRatings")
+        date_loc, date_utc = observation_dates(exif)
+        date_obs = date_utc or date_loc # The local date, as in DATE-OBS, when the time zone is unknown
+        return FrameInfo(path, stat.st_mtime, stat.st_size, _number(exif, "ExposureTime"), None if iso is None else int(iso),
+                         date_loc, date_obs, _text(exif, "Model"), _text(exif, "LensModel"),
+                         _number(exif, "FocalLength"), None)
+    except Exception as e:
+        return FrameInfo(path, stat.st_mtime, stat.st_size, *[None]*7, f"{type(e).__name__}: {e}")
+
+def scan(paths, workers=None):
+    """Read the metadata of many raw files, in parallel worker processes for large lists. See scan_file."""
+    workers = workers or os.cpu_count()
+    if len(paths) < _PARALLEL_MIN_FILES or workers == 1:
+        return [scan_file(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return list(executor.map(scan_file, paths, chunksize=max(1, len(paths) // (4*workers))))
+
+
+class Catalog():
+    """SQLite index of the metadata of raw files.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database, created if it does not exist. ":memory:" keeps it in memory.
+
+    """
+    _COLUMNS = FrameInfo._fields
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS frames (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, exposure_time REAL, "
+                         "iso INTEGER, date_loc TEXT, date_obs TEXT, model TEXT, lens TEXT, focal_length REAL, error TEXT)")
+        self._db.commit()
+
+    def __repr__(self):
+        return f"Catalog(path={self.path}, frames={len(self)})"
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM frames").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def update(self, inputs, workers=None, prune=True):
+        """Add raw files to the catalog, scanning only those that are new or changed.
+
+        Parameters
+        ----------
+        inputs : list of str
+            Raw files, directories or glob patterns, see raw2fits.batch.find_raw_files.
+        workers : int, optional
+            Number of worker processes for the scan, see scan.
+        prune : bool
+            Remove files from the catalog that no longer exist.
+
+        Returns
+        -------
+        scanned, unchanged, removed : int
+            Number of files scanned, files skipped as unchanged and entries removed.
+
+        """
+        paths = [os.path.abspath(path) for path in find_raw_files(inputs)]
+        known = {path: (mtime, size) for path, mtime, size in self._db.execute("SELECT path, mtime, size FROM frames")}
+        stale, unchanged = [], 0
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError: # Deleted since the directory was listed, removed below if cataloged
+                continue
+            if known.get(path) != (stat.st_mtime, stat.st_size):
+                stale.append(path)
+            else:
+                unchanged += 1
+        infos = scan(stale, workers=workers)
+        placeholders = ", ".join("?"*len(self._COLUMNS))
+        self._db.executemany(f"INSERT OR REPLACE INTO frames VALUES ({placeholders})", infos)
+        removed = [path for path in known if not os.path.exists(path)] if prune else []
+        self._db.executemany("DELETE FROM frames WHERE path = ?", [(path,) for path in removed])
+        self._db.commit()
+        return len(stale), unchanged, len(removed)
+
+    def frames(self, **filters):
+        """Return the FrameInfo of the cataloged files, sorted by date, e.g. frames(model="EOS 6D", iso=1600)."""
+        for column in filters:
+            if column not in self._COLUMNS:
+                raise ValueError(f"Invalid column {column}. Must be one of {', '.join(self._COLUMNS)}.")
+        where = " AND ".join(f"{column} IS ?" for column in filters)
+        query = f"SELECT * FROM frames {'WHERE ' + where if where else ''} ORDER BY date_obs, path"
+        return [FrameInfo(*row) for row in self._db.execute(query, tuple(filters.values()))]
+
+    def groups(self, keys=("model", "iso", "exposure_time")):
+        """Group the cataloged files by metadata, e.g. to match darks to lights.
+
+        Parameters
+        ----------
+        keys : tuple of str
+            FrameInfo fields to group by.
+
+        Returns
+        -------
+        groups : dict
+            Maps each tuple of key values to the list of paths in the group, sorted by date.
+
+        """
+        for column in keys:
+            if column not in self._COLUMNS:
+                raise ValueError(f"Invalid column {column}. Must be one of {', '.join(self._COLUMNS)}.")
+        groups = {}
+        columns = ", ".join(keys)
+        for row in self._db.execute(f"SELECT {columns}, path FROM frames WHERE error IS NULL ORDER BY {columns}, date_obs, path"):
+            groups.setdefault(tuple(row[:-1]), []).append(row[-1])
+        return groups
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="raw2fits-catalog", description="Index the metadata of raw files and group them.")
+    parser.add_argument("inputs", nargs="*", help="raw files, directories or glob patterns to add or re-scan")
+    parser.add_argument("--db", default="raw2fits.sqlite", help="SQLite catalog (default: raw2fits.sqlite)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--group-by", nargs="+", default=["model", "iso", "exposure_time"], choices=FrameInfo._fields,
+                        help="fields to group the frames by (default: model iso exposure_time)")
+    args = parser.parse_args(argv)
+
+    with Catalog(args.db) as catalog:
+        if args.inputs:
+            scanned, unchanged, removed = catalog.update(args.inputs, workers=args.workers)
+            print(f"Scanned {scanned} files, {unchanged} unchanged, {removed} removed")
+        for key, paths in catalog.groups(args.group_by).items():
+            description = ", ".join(f"{name}={value}" for name, value in zip(args.group_by, key))
+            print(f"{description}: {len(paths)} frames")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,118 @@
+import numpy as np
+
+
+BAYER_PATTERNS = ("RGGB", "BGGR", "GRBG", "GBRG")
+
+
+def red_site(bayer_pattern):
+    """Return the (row, column) of the red site in the 2x2 tile of a Bayer pattern."""
+    if bayer_pattern not in BAYER_PATTERNS:
+        raise ValueError(f"Bayer pattern {bayer_pattern} does not support.")
+    return divmod(bayer_pattern.index("R"), 2)
+
+def strip_with_halo(bayer_img, rows, halo):
+    """Slice a range of rows of a mosaic together with up to halo rows of context on either side.
+
+    Parameters
+    ----------
+    bayer_img : ndarray
+        2D Bayer mosaic.
+    rows : tuple of int
+        (start, stop) range of rows requested. None means all rows.
+    halo : int
+        Rows of context to include above and below, fewer at the borders of the mosaic.
+        Must be even, so that the strip starts on the same CFA phase as the mosaic.
+
+    Returns
+    -------
+    strip : ndarray
+        View of the rows with their halo.
+    crop : slice
+        The requested rows within strip.
+
+    """
+    if rows is None:
+        return bayer_img, slice(0, bayer_img.shape[0])
+    row_start, row_stop = rows
+    halo_start, halo_stop = max(row_start - halo, 0), min(row_stop + halo, bayer_img.shape[0])
+    return bayer_img[halo_start:halo_stop], slice(row_start - halo_start, row_stop - halo_start)
+
+def roi_origin(roi):
+    """Return the (row, column) of the top-left pixel of a region of interest (x, y, width, height)
+    snapped to whole 2x2 Bayer tiles, see snap_roi. It does not depend on the size of the mosaic."""
+    x, y = roi[:2]
+    return y // 2 * 2, x // 2 * 2
+
+def snap_roi(shape, roi):
+    """Snap a region of interest of a mosaic to whole 2x2 Bayer tiles.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        (height, width) of the mosaic.
+    roi : tuple of int
+        (x, y, width, height) of the region, in pixels of the mosaic.
+
+    Returns
+    -------
+    rows, cols : slice
+        The region with its offsets rounded down and its ends rounded up to even pixels, clipped
+        to the mosaic. The region starts on the same CFA phase as the mosaic, so it has the same
+        Bayer pattern.
+
+    """
+    x, y, width, height = roi
+    if x < 0 or y < 0 or width < 1 or height < 1 or x >= shape[1] or y >= shape[0]:
+        raise ValueError(f"Invalid region of interest {tuple(roi)} for a mosaic of shape {tuple(shape)}.")
+    row_start, col_start = roi_origin(roi)
+    row_stop, col_stop = min(-(-(y + height) // 2) * 2, shape[0]), min(-(-(x + width) // 2) * 2, shape[1])
+    return slice(row_start, row_stop), slice(col_start, col_stop)
+
+def crop_cfa(bayer_img, roi):
+    """Return a view of the region of interest of a mosaic, snapped to whole Bayer tiles (see snap_roi)."""
+    return bayer_img[snap_roi(bayer_img.shape, roi)]
+
+def binned_shape(shape, factor):
+    """Return the shape of a mosaic of shape shape binned by factor with bin_cfa. Incomplete bins at the
+    bottom and right edges are dropped."""
+    if factor == 1:
+        return tuple(shape)
+    return (shape[0] // (2*factor) * 2, shape[1] // (2*factor) * 2)
+
+def bin_cfa(bayer_img, factor):
+    """Bin a Bayer mosaic by factor in both directions, keeping its Bayer pattern.
+
+    Like on-chip binning of a color sensor, each site of the output averages the factor x factor
+    sites of the same color in a block of 2*factor x 2*factor pixels, so the output is a mosaic
+    with the same Bayer pattern that can be debayered as usual.
+
+    Parameters
+    ----------
+    bayer_img : ndarray
+        2D Bayer mosaic.
+    factor : int
+        Binning factor, e.g. 2 for 2x2 binning.
+
+    Returns
+    -------
+    binned : ndarray
+        Binned mosaic of the same dtype, see binned_shape for its shape. Integer mosaics are
+        rounded to the nearest value.
+
+    """
+    if factor < 1 or int(factor) != factor:
+        raise ValueError(f"The binning factor must be a positive integer, got {factor}.")
+    factor = int(factor)
+    height, width = binned_shape(bayer_img.shape, factor)
+    if factor == 1:
+        return bayer_img
+    binned = np.empty((height, width), dtype=bayer_img.dtype)
+    n = factor*factor
+    for dy in range(2):
+        for dx in range(2): # One color site of the 2x2 tile at a time
+            sites = bayer_img[dy:height*factor:2, dx:width*factor:2].reshape(height//2, factor, width//2, factor)
+            if np.issubdtype(bayer_img.dtype, np.integer):
+                binned[dy::2, dx::2] = (sites.sum(axis=(1, 3), dtype=np.uint64) + n // 2) // n
+            else:
+                binned[dy::2, dx::2] = sites.mean(axis=(1, 3))
+    return binned
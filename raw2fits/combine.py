@@ -0,0 +1,78 @@
+"""Pixel-wise combination of a stack of frames.
+
+The stack is usually a memory map spilled to disk, so it is combined a block of rows
+at a time: only one block of every frame is converted to float and held in memory.
+"""
+import numpy as np
+
+
+COMBINE_METHODS = ("mean", "median", "sigma_clip")
+_CHUNK_BYTES = 64 << 20 # Memory budget of one block of rows across all frames
+
+
+def combine(stack, method="median", sigma=3.0, iterations=5, offset=None, scales=None, chunk_rows=None, out=None):
+    """Combine a stack of frames pixel by pixel.
+
+    Parameters
+    ----------
+    stack : ndarray
+        Frames to combine, shape (n_frames, height, width), e.g. a np.memmap.
+    method : str
+        "mean", "median" or "sigma_clip" (mean of the pixels within sigma standard
+        deviations of the median, iterated).
+    sigma : float
+        Clipping threshold of "sigma_clip", in standard deviations.
+    iterations : int
+        Maximum number of clipping iterations of "sigma_clip".
+    offset : ndarray, optional
+        Frame of shape (height, width) subtracted from every frame before combining, e.g. a master bias.
+    scales : ndarray, optional
+        Factor per frame applied after subtracting offset, e.g. to normalize flats to a common level.
+    chunk_rows : int, optional
+        Rows combined at a time. Defaults to a block of about 64 MB.
+    out : ndarray, optional
+        Array of shape (height, width) to write the result to.
+
+    Returns
+    -------
+    combined : ndarray
+        The combined frame, float32.
+
+    """
+    if method not in COMBINE_METHODS:
+        raise ValueError(f"Invalid method {method}. Must be one of {', '.join(COMBINE_METHODS)}.")
+    n_frames, height, width = stack.shape
+    if out is None:
+        out = np.empty((height, width), dtype=np.float32)
+    chunk_rows = chunk_rows or max(1, _CHUNK_BYTES // (n_frames*width*4))
+    for row_start in range(0, height, chunk_rows):
+        rows = slice(row_start, min(row_start + chunk_rows, height))
+        chunk = np.array(stack[:, rows], dtype=np.float32) # Private float copy of the block, modified in place
+        if offset is not None:
+            chunk -= offset[rows]
+        if scales is not None:
+            chunk *= np.asarray(scales, dtype=np.float32)[:, None, None]
+        out[rows] = combine_chunk(chunk, method, sigma, iterations)
+    return out
+
+def combine_chunk(chunk, method="median", sigma=3.0, iterations=5):
+    """Combine a float block of frames over its first axis, see combine. Rejected values of
+    "sigma_clip" are set to NaN in chunk."""
+    if method == "mean":
+        return chunk.mean(axis=0)
+    if method == "median":
+        return np.median(chunk, axis=0)
+    if method == "sigma_clip":
+        return _sigma_clipped_mean(chunk, sigma, iterations)
+    raise ValueError(f"Invalid method {method}. Must be one of {', '.join(COMBINE_METHODS)}.")
+
+def _sigma_clipped_mean(chunk, sigma, iterations):
+    """Mean over the first axis of chunk, rejecting values more than sigma standard deviations from the median."""
+    for _ in range(iterations):
+        center = np.nanmedian(chunk, axis=0)
+        spread = np.nanstd(chunk, axis=0)
+        outliers = np.abs(chunk - center) > sigma*spread # NaN (already rejected) compares False
+        if not outliers.any():
+            break
+        chunk[outliers] = np.nan
+    return np.nanmean(chunk, axis=0)
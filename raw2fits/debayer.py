@@ -1,239 +1,213 @@
+import importlib
+import inspect
 import os
 import numpy as np
-import numba as nb
-from numba_progress import ProgressBar
-import cv2
-import rawpy
+from raw2fits import instrument
+from raw2fits.cfa import bin_cfa, crop_cfa
 
 
-def _debayer_VNG(bayer_img, color_index_map, color_desc):
-    """Debayer a Bayer image using VNG interpolation.
+# Debayer backend registry: method -> {engine: (function, names of its keyword arguments)}, in order of preference.
+# Every backend takes (bayer_img, bayer_pattern, rows=None) and either of the n_threads and precision options.
+# A backend registered as a "module:function" string is imported the first time it is used, so that importing
+# raw2fits does not pay for numba and OpenCV unless their engines actually run.
+_BACKENDS = {}
+_SCALES = {} # method -> downscaling factor of its output (2 for superpixel)
+_VERSIONS = {} # (method, engine) -> version of the output of the engine, part of the keys of raw2fits.cache
+_PRECISIONS = {"float64": np.float64, "float32": np.float32} # Working precisions of the VNG kernels
+_PROGRESS_BLOCKS = 8 # Blocks of rows per frame debayered by debayer_array when progress is reported
+
+def register_backend(method, engine, function, scale=1, version="1"):
+    """Register an implementation of a debayer method.
 
     Parameters
     ----------
-    bayer_img : ndarray
-        Input Bayer image.
-    color_index_map : ndarray
-        Color index map.
-    color_desc : dict
-        Color description.
-
-    Returns
-    -------
-    output : ndarray
-        Output image.
+    method : str
+        Name of the debayer method, e.g. "VNG".
+    engine : str
+        Name of the implementation, e.g. "numba". The first engine registered for a method is its default.
+    function : callable or str
+        function(bayer_img, bayer_pattern, rows=None, **options) returning a uint16 array of shape
+        (3, rows, width) for the (start, stop) range of mosaic rows. Of the options n_threads and
+        precision, only those in the signature of the function are passed to it. A string
+        "module:function" is imported lazily, the first time the backend is used.
+    scale : int
+        Downscaling factor of the output relative to the mosaic. All engines of a method must have
+        the same scale, as they are interchangeable.
+    version : str
+        Version of the output of the engine. Change it whenever the engine computes different pixels,
+        so that images debayered by the previous version are not loaded from a raw2fits.cache.DebayerCache.
 
     """
-    # OpenCV's VNG interpolation is designed for 8-bit image, so we write the algorithm ourselves.
-    # To see VNG interpolation in action, see https://ui.adsabs.harvard.edu/abs/1999SPIE.3650...36C/abstract
-    # color_index_map is a 2D array of the same size as bayer_img, where each element is an integer from 0 to 3
-    # indicating the color of the corresponding pixel in bayer_img.
-    # color_desc is a list of 4 strings, each string is the name of the color corresponding to the index in color_index_map.
-    # For example, if color_index_map[0, 0] = 0, then color_desc[0] is the name of the color of the pixel at (0, 0).
-    # The order of the colors in color_desc is the same as the order of the colors in the Bayer pattern.
-    # For example, if the Bayer pattern is RGGB, then color_desc[0] is "R", color_desc[1] is "G", color_desc[2] is "G", and color_desc[3] is "B".
-    # Return a 3D array of the same size as bayer_img, where the first dimension is the color channel (red, green, blue).
-
-    bayer_img_extended = np.pad(bayer_img, ((2, 2), (2, 2)), mode="edge").astype(np.float64) # Extend the image by 2 pixels on each side for VNG interpolation
-    color_index_map_extended = np.pad(color_index_map, ((2, 2), (2, 2)), mode="edge")      # Extend the color index map by 2 pixels on each side for VNG interpolation
-    color_desc_numba = nb.typed.List(color_desc) # Convert color_desc to a numba typed list for use in the numba function
-    output = np.zeros((3, bayer_img.shape[0], bayer_img.shape[1]), dtype=np.float64) # Output image
-
-    @nb.njit(parallel=False, fastmath=True)
-    def interpolation(I, C, color_desc, output, progress_proxy):
-        for i in nb.prange(2, I.shape[0] - 2):
-            for j in nb.prange(2, I.shape[1] - 2):
-                if color_desc[C[i, j]] == "G":
-                    # Temporary variables
-                    g1 , b1 , g2 , b2 , g3  = I[i-2, j-2:j+3]
-                    r1 , g4 , r2 , g5 , r3  = I[i-1, j-2:j+3]
-                    g6 , b3 , g7 , b4 , g8  = I[i  , j-2:j+3]
-                    r4 , g9 , r5 , g10, r6  = I[i+1, j-2:j+3]
-                    g11, b5 , g12, b6 , g13 = I[i+2, j-2:j+3]
-                    # Gradient calculation
-                    grad_N = abs(r2-r5) + abs(g2-g7) + abs(g4-g9)/2 + abs(g5-g10)/2 + abs(b1-b3)/2 + abs(b2-b4)/2
-                    grad_E = abs(b4-b3) + abs(g8-g7) + abs(g5-g4)/2 + abs(g10-g9)/2 + abs(r3-r2)/2 + abs(r6-r5)/2
-                    grad_S = abs(r5-r2) + abs(g12-g7) + abs(g9-g4)/2 + abs(g10-g5)/2 + abs(b5-b3)/2 + abs(b6-b4)/2
-                    grad_W = abs(b3-b4) + abs(g6-g7) + abs(g4-g5)/2 + abs(g9-g10)/2 + abs(r1-r2)/2 + abs(r4-r5)/2
-                    grad_NE = abs(g5-g9) + abs(g3-g7) + abs(b2-b3) + abs(r3-r5)
-                    grad_SE = abs(g10-g4) + abs(g13-g7) + abs(b6-b3) + abs(r6-r2)
-                    grad_NW = abs(g4-g10) + abs(g1-g7) + abs(b1-b4) + abs(r1-r5)
-                    grad_SW = abs(g9-g5) + abs(g11-g7) + abs(b5-b4) + abs(r4-r2)
-                    # Threshold calculation
-                    MAX = max(grad_N, grad_E, grad_S, grad_W, grad_NE, grad_SE, grad_NW, grad_SW)
-                    MIN = min(grad_N, grad_E, grad_S, grad_W, grad_NE, grad_SE, grad_NW, grad_SW)
-                    threshold = 1.5*MIN + 0.5*(MAX-MIN)
-                    cnt = 0
-                    sum_R, sum_G, sum_B = 0.0, 0.0, 0.0
-                    if grad_N <= threshold:
-                        cnt += 1
-                        sum_R += r2
-                        sum_G += (g2+g7)/2
-                        sum_B += (b1+b2+b3+b4)/4
-                    if grad_E <= threshold:
-                        cnt += 1
-                        sum_R += (r2+r3+r5+r6)/4
-                        sum_G += (g8+g7)/2
-                        sum_B += b4
-                    if grad_S <= threshold:
-                        cnt += 1
-                        sum_R += r5
-                        sum_G += (g12+g7)/2
-                        sum_B += (b3+b4+b5+b6)/4
-                    if grad_W <= threshold:
-                        cnt += 1
-                        sum_R += (r1+r2+r4+r5)/4
-                        sum_G += (g6+g7)/2
-                        sum_B += b3
-                    if grad_NE <= threshold:
-                        cnt += 1
-                        sum_R += (r2+r3)/2
-                        sum_G += g5
-                        sum_B += (b2+b4)/2
-                    if grad_SE <= threshold:
-                        cnt += 1
-                        sum_R += (r5+r6)/2
-                        sum_G += g10
-                        sum_B += (b4+b6)/2
-                    if grad_NW <= threshold:
-                        cnt += 1
-                        sum_R += (r1+r2)/2
-                        sum_G += g4
-                        sum_B += (b1+b3)/2
-                    if grad_SW <= threshold:
-                        cnt += 1
-                        sum_R += (r4+r5)/2
-                        sum_G += g9
-                        sum_B += (b3+b5)/2
-                    # Blue Row
-                    if i%2 == 1:
-                        output[0, i-2, j-2] = g7 + (sum_R - sum_G)/cnt
-                        output[1, i-2, j-2] = g7
-                        output[2, i-2, j-2] = g7 + (sum_B - sum_G)/cnt
-                    # Red Row
-                    else:   
-                        output[0, i-2, j-2] = g7 + (sum_B - sum_G)/cnt
-                        output[1, i-2, j-2] = g7
-                        output[2, i-2, j-2] = g7 + (sum_R - sum_G)/cnt
-                elif color_desc[C[i, j]] == "R" or color_desc[C[i, j]] == "B":
-                    # Temporary variables
-                    r1 , g1 , r2 , g2 , r3  = I[i-2, j-2:j+3]
-                    g3 , b1 , g4 , b2 , g5  = I[i-1, j-2:j+3]
-                    r4 , g6 , r5 , g7 , r6  = I[i  , j-2:j+3]
-                    g8 , b3 , g9 , b4 , g10 = I[i+1, j-2:j+3]
-                    r7 , g11, r8 , g12, r9  = I[i+2, j-2:j+3]
-                    # Gradient calculation
-                    grad_N = abs(g4-g9) + abs(r2-r5) + abs(b1-b3)/2 + abs(b2-b4)/2 + abs(g1-g6)/2 + abs(g2-g7)/2
-                    grad_E = abs(g7-g6) + abs(r6-r5) + abs(b2-b1)/2 + abs(b4-b3)/2 + abs(g5-g4)/2 + abs(g10-g9)/2
-                    grad_S = abs(g9-g4) + abs(r8-r5) + abs(b3-b1)/2 + abs(b4-b2)/2 + abs(g11-g6)/2 + abs(g12-g7)/2
-                    grad_W = abs(g6-g7) + abs(r4-r5) + abs(b1-b2)/2 + abs(b3-b4)/2 + abs(g3-g4)/2 + abs(g8-g9)/2
-                    grad_NE = abs(b2-b3) + abs(r3-r5) + abs(g4-g6)/2 + abs(g7-g9)/2 + abs(g2-g4)/2 + abs(g5-g7)/2
-                    grad_SE = abs(b4-b1) + abs(r9-r5) + abs(g7-g4)/2 + abs(g9-g6)/2 + abs(g10-g7)/2 + abs(g12-g9)/2
-                    grad_NW = abs(b1-b4) + abs(r1-r5) + abs(g4-g7)/2 + abs(g6-g9)/2 + abs(g1-g4)/2 + abs(g3-g6)/2
-                    grad_SW = abs(b3-b2) + abs(r7-r5) + abs(g6-g4)/2 + abs(g9-g7)/2 + abs(g8-g6)/2 + abs(g11-g9)/2
-                    # Threshold calculation
-                    MAX = max(grad_N, grad_E, grad_S, grad_W, grad_NE, grad_SE, grad_NW, grad_SW)
-                    MIN = min(grad_N, grad_E, grad_S, grad_W, grad_NE, grad_SE, grad_NW, grad_SW)
-                    threshold = 1.5*MIN + 0.5*(MAX-MIN)
-                    cnt = 0
-                    sum_R, sum_G, sum_B = 0.0, 0.0, 0.0
-                    if grad_N <= threshold:
-                        cnt += 1
-                        sum_R += (r2+r5)/2
-                        sum_G += g4
-                        sum_B += (b1+b2)/2
-                    if grad_E <= threshold:
-                        cnt += 1
-                        sum_R += (r6+r5)/2
-                        sum_G += g7
-                        sum_B += (b2+b4)/2
-                    if grad_S <= threshold:
-                        cnt += 1
-                        sum_R += (r8+r5)/2
-                        sum_G += g9
-                        sum_B += (b3+b4)/2
-                    if grad_W <= threshold:
-                        cnt += 1
-                        sum_R += (r4+r5)/2
-                        sum_G += g6
-                        sum_B += (b1+b3)/2
-                    if grad_NE <= threshold:
-                        cnt += 1
-                        sum_R += (r3+r5)/2
-                        sum_G += (g2+g4+g5+g7)/4
-                        sum_B += b2
-                    if grad_SE <= threshold:
-                        cnt += 1
-                        sum_R += (r9+r5)/2
-                        sum_G += (g7+g9+g10+g12)/4
-                        sum_B += b4
-                    if grad_NW <= threshold:
-                        cnt += 1
-                        sum_R += (r1+r5)/2
-                        sum_G += (g1+g3+g4+g6)/4
-                        sum_B += b1
-                    if grad_SW <= threshold:
-                        cnt += 1
-                        sum_R += (r7+r5)/2
-                        sum_G += (g6+g8+g9+g11)/4
-                        sum_B += b3
-
-                    if color_desc[C[i, j]] == "R":
-                        output[0, i-2, j-2] = r5
-                        output[1, i-2, j-2] = r5 + (sum_G - sum_R)/cnt
-                        output[2, i-2, j-2] = r5 + (sum_B - sum_R)/cnt
-                    elif color_desc[C[i, j]] == "B":
-                        output[0, i-2, j-2] = r5 + (sum_B - sum_R)/cnt
-                        output[1, i-2, j-2] = r5 + (sum_G - sum_R)/cnt
-                        output[2, i-2, j-2] = r5
-                progress_proxy.update(1)
-        return output
-    
-    with ProgressBar(total=(bayer_img_extended.shape[0] - 4)*(bayer_img_extended.shape[1] - 4)) as progress:
-        output = interpolation(I=bayer_img_extended, C=color_index_map_extended, color_desc=color_desc_numba, output=output, progress_proxy=progress)
-        output[output <= 0.0] = 0.0 # Clip negative values
-        output[output >= 65535.0] = 65535.0 # Clip values above 65535
-        return output.astype(np.uint16) # Convert to 16-bit unsigned integer
-
-def _debayer_bilinear(bayer_img, color_desc):
-    """Debayer a Bayer image using bilinear interpolation.
-
+    other_engines = set(_BACKENDS.get(method, {})) - {engine}
+    if other_engines and _SCALES[method] != scale:
+        raise ValueError(f"Method {method} has scale {_SCALES[method]} (engines {', '.join(sorted(other_engines))}), "
+                         f"but engine {engine} is registered with scale {scale}.")
+    _BACKENDS.setdefault(method, {})[engine] = function if isinstance(function, str) else _options(function)
+    _SCALES[method] = scale
+    _VERSIONS[(method, engine)] = str(version)
+
+def _options(function):
+    """Return (function, names of the options in its signature)."""
+    return function, {name for name in inspect.signature(function).parameters if name in ("n_threads", "precision")}
+
+def _resolve(spec):
+    """Import a backend registered as a "module:function" string."""
+    module, name = spec.split(":")
+    return _options(getattr(importlib.import_module(module), name))
+
+def backends():
+    """Return the registered debayer methods and their engines, e.g. {"VNG": ["numba", "numpy"], ...}."""
+    return {method: list(engines) for method, engines in _BACKENDS.items()}
+
+def select_engine(method, engine=None):
+    """Return the engine that runs method. engine is a hint: if the method has no implementation
+    for it, the default engine of the method is used. Nothing is imported."""
+    if method not in _BACKENDS:
+        raise ValueError(f"Invalid method. Must be one of {', '.join(repr(name) for name in _BACKENDS)}.")
+    all_engines = {name for engines in _BACKENDS.values() for name in engines}
+    if engine is not None and engine not in all_engines:
+        raise ValueError(f"Invalid engine. Must be one of {', '.join(repr(name) for name in sorted(all_engines))}.")
+    return engine if engine in _BACKENDS[method] else next(iter(_BACKENDS[method]))
+
+def backend_version(method, engine=None):
+    """Return the version of the output of the engine that runs method, see select_engine. Nothing is imported."""
+    return _VERSIONS[(method, select_engine(method, engine))]
+
+def _backend(method, engine=None):
+    """Select the implementation of method, see select_engine. Returns (engine, function, options)."""
+    engine = select_engine(method, engine)
+    engines = _BACKENDS[method]
+    if isinstance(engines[engine], str): # Import a lazily registered backend on first use
+        engines[engine] = _resolve(engines[engine])
+    return (engine, *engines[engine])
+
+# Bump the version of an engine with every change to its output, e.g. in raw2fits.debayer_numba, debayer_numpy or debayer_opencv
+register_backend("VNG", "numba", "raw2fits.debayer_numba:debayer_VNG", version="1")
+register_backend("VNG", "numpy", "raw2fits.debayer_numpy:debayer_VNG", version="1")
+register_backend("Bilinear", "opencv", "raw2fits.debayer_opencv:debayer_bilinear", version="1")
+register_backend("Bilinear", "numpy", "raw2fits.debayer_numpy:debayer_bilinear", version="1")
+register_backend("EdgeAware", "opencv", "raw2fits.debayer_opencv:debayer_edge_aware", version="1")
+register_backend("Superpixel", "numpy", "raw2fits.debayer_numpy:debayer_superpixel", scale=2, version="1")
+
+
+def warmup():
+    """Compile the numba debayer kernels ahead of time, see `raw2fits.debayer_numba.warmup`."""
+    from raw2fits import debayer_numba
+    debayer_numba.warmup()
+
+
+def debayer_strips(bayer_img, bayer_pattern, strip_rows, method="VNG", engine=None, n_threads=None, precision="float64"):
+    """Debayer a Bayer mosaic strip by strip.
+
+    Only one strip of output is held at a time, so the memory used on top of the mosaic
+    is bounded by strip_rows rather than by the height of the image. The strips are
+    bit-identical to the corresponding rows of `debayer_array`. A "debayer" progress
+    event (see `raw2fits.instrument`) is reported after every strip, in mosaic rows.
     Parameters
     ----------
     bayer_img : ndarray
-        Input Bayer image.
-    color_desc : dict
-        Color description.
-
+        2D Bayer mosaic.
+    bayer_pattern : str
+        Bayer pattern of the top-left 2x2 tile of the mosaic.
+    strip_rows : int
+        Number of mosaic rows per strip. Must be even, so that every strip starts on the same CFA phase.
+    method, engine, n_threads, precision
+        See `debayer_array`.
+    Yields
+    ------
+    row_start : int
+        First row of the strip in the output image.
+    strip : ndarray
+        The debayered strip, shape (3, rows, width).
+    """
+    if strip_rows < 2 or strip_rows % 2 != 0:
+        raise ValueError(f"strip_rows must be a positive even number, got {strip_rows}.")
+    engine, function, options = _backend(method, engine)
+    scale = _SCALES[method]
+    height = bayer_img.shape[0] // scale * scale
+    kwargs = {name: value for name, value in (("n_threads", n_threads), ("precision", precision)) if name in options}
+    for row_start in range(0, height, strip_rows):
+        rows = (row_start, min(row_start + strip_rows, height))
+        strip = function(bayer_img, bayer_pattern, rows=rows, **kwargs)
+        instrument.progress("debayer", rows[1], height)
+        yield row_start // scale, strip
+
+def debayer_array(bayer_img, bayer_pattern, method="VNG", engine=None, n_threads=None, precision="float64", strip_rows=None, out=None):
+    """Debayer a Bayer mosaic that is already in memory.
+    Parameters
+    ----------
+    bayer_img : ndarray
+        2D Bayer mosaic, e.g. `rawpy.RawPy.raw_image_visible`.
+    bayer_pattern : str
+        Bayer pattern of the top-left 2x2 tile of the mosaic, one of "RGGB", "BGGR", "GRBG" or "GBRG".
+    method : str
+        Debayering method to use: "VNG", "Bilinear", "EdgeAware" or "Superpixel" (2x2 binning to half
+        resolution), or any method added with `register_backend`.
+    engine : str, optional
+        Preferred implementation: "numba", "numpy" or "opencv". Methods without an implementation for
+        it use their default engine. See `backends`.
+    n_threads : int, optional
+        Number of threads used by the VNG kernel. Defaults to all available cores.
+    precision : str
+        Floating point precision of the VNG kernel, "float64" or "float32". The results
+        differ by at most 1 ADU.
+    strip_rows : int, optional
+        Debayer in strips of this many rows (see `debayer_strips`) and copy each strip into out.
+    out : ndarray, optional
+        Preallocated uint16 array to write the result to, e.g. a np.memmap. Implies strips of 256
+        rows if strip_rows is not given.
+
+    The whole frame is debayered in one call to the backend, unless strips are requested or a
+    sink of `raw2fits.instrument` is registered: then the frame is debayered in a few blocks of
+    rows, with a "debayer" progress event after each.
     Returns
     -------
     output : ndarray
-        Output image.
-
+        The debayered image, shape (3, height, width), or (3, height/2, width/2) for "Superpixel".
     """
-    # Create output image
-    bayer_pattern = "".join(color_desc)
-    if bayer_pattern == "RGGB" or bayer_pattern == "RGBG":
-        output = cv2.cvtColor(bayer_img, cv2.COLOR_BayerBG2RGB) # Use OpenCV's debayering function
-    elif bayer_pattern == "BGGR":
-        output = cv2.cvtColor(bayer_img, cv2.COLOR_BayerRG2RGB) # Use OpenCV's debayering function
-    elif bayer_pattern == "GRBG":
-        output = cv2.cvtColor(bayer_img, cv2.COLOR_BayerGB2RGB)
-    elif bayer_pattern == "GBRG":
-        output = cv2.cvtColor(bayer_img, cv2.COLOR_BayerGR2RGB)
-    else:
-        raise ValueError(f"Bayer pattern {bayer_pattern} does not support.")
-
-    return np.moveaxis(output, -1, 0) # Move color channel axis to the front
-    
-def debayer(path, method="VNG"):
+    if strip_rows is None and out is None and instrument.enabled():
+        strip_rows = -(-bayer_img.shape[0] // (2*_PROGRESS_BLOCKS)) * 2 # Even, so that every block starts on the same CFA phase
+    if strip_rows is not None or out is not None:
+        if out is None:
+            out = np.empty(output_shape(bayer_img.shape, method), dtype=np.uint16)
+        for row_start, strip in debayer_strips(bayer_img, bayer_pattern, strip_rows or 256, method=method, engine=engine, n_threads=n_threads, precision=precision):
+            out[:, row_start:row_start + strip.shape[1]] = strip
+        return out
+
+    engine, function, options = _backend(method, engine)
+    kwargs = {name: value for name, value in (("n_threads", n_threads), ("precision", precision)) if name in options}
+    return function(bayer_img, bayer_pattern, **kwargs)
+
+def output_scale(method="VNG"):
+    """Return the downscaling factor of the output of a method relative to the mosaic, e.g. 2 for "Superpixel"."""
+    select_engine(method) # Validate the method
+    return _SCALES[method]
+
+def output_shape(bayer_shape, method="VNG"):
+    """Return the shape of the debayered image of a mosaic of shape bayer_shape."""
+    scale = output_scale(method)
+    return (3, bayer_shape[0] // scale, bayer_shape[1] // scale)
+
+def debayer(path, method="VNG", engine=None, n_threads=None, precision="float64", binning=1, roi=None):
     """Debayer a raw image using the specified method.
     Parameters
     ----------
     path : str
         Path to the raw image.
     method : str
-        Debayering method to use. Must be one of "VNG" or "Bilinear".
+        Debayering method to use, see `debayer_array`.
+    engine : str, optional
+        Preferred implementation, see `debayer_array`.
+    n_threads : int, optional
+        Number of threads used by the VNG kernel. Defaults to all available cores.
+    precision : str
+        Floating point precision of the VNG kernel, "float64" or "float32". The results
+        differ by at most 1 ADU.
+    binning : int
+        CFA binning factor applied before debayering, see `raw2fits.cfa.bin_cfa`.
+    roi : tuple of int, optional
+        (x, y, width, height) region of interest of the mosaic, in unbinned pixels, snapped to whole
+        Bayer tiles and cropped before binning, see `raw2fits.cfa.crop_cfa`.
     Returns
     -------
     output : ndarray
@@ -243,19 +217,20 @@ def debayer(path, method="VNG"):
     if not os.path.exists(path):
         raise FileNotFoundError(f"File {path} does not exist.")
 
+    import rawpy # Imported on use, like the debayer backends
 
     # Read raw image
     with rawpy.imread(path) as raw:
         bayer_img = raw.raw_image_visible # Bayer image
-        color_index_map = raw.raw_colors_visible # Color index map
-        color_desc = [*raw.color_desc.decode()] # Color description
+        bayer_pattern = raw_bayer_pattern(raw) # Bayer pattern of the visible area
+        if roi is not None:
+            bayer_img = crop_cfa(bayer_img, roi).copy() # Contiguous, as OpenCV would read the pixels around a view
+        bayer_img = bin_cfa(bayer_img, binning)
 
         # Debayer image
-        if method == "VNG":
-            return _debayer_VNG(bayer_img=bayer_img, color_index_map=color_index_map, color_desc=color_desc)
-        elif method == "Bilinear":
-            return _debayer_bilinear(bayer_img=bayer_img, color_desc=color_desc)
-        else:
-            raise ValueError("Invalid method. Must be one of 'VNG' or 'Bilinear'.")
-
+        return debayer_array(bayer_img, bayer_pattern, method=method, engine=engine, n_threads=n_threads, precision=precision)
 
+def raw_bayer_pattern(raw):
+    """Return the Bayer pattern (e.g. "RGGB") of the visible area of an opened rawpy image."""
+    color_desc = raw.color_desc.decode() # Color description, e.g. "RGBG"
+    return "".join(color_desc[index] for index in raw.raw_colors_visible[:2, :2].flatten())
@@ -0,0 +1,240 @@
+"""Debayer backend compiled with numba.
+
+The VNG kernel runs in parallel over row tiles with the GIL released. Importing this
+module imports numba, which takes about a second, so raw2fits.debayer only imports it
+the first time the "numba" engine is used.
+"""
+import numpy as np
+import numba as nb
+
+from raw2fits.cfa import red_site
+from raw2fits.debayer import _PRECISIONS
+
+
+@nb.njit(fastmath=True, cache=True)
+def _neighbours(I, row, cols, one):
+    """Read five pixels of a row of the mosaic I, converted to the working precision of one."""
+    cast = type(one)
+    return cast(I[row, cols[0]]), cast(I[row, cols[1]]), cast(I[row, cols[2]]), cast(I[row, cols[3]]), cast(I[row, cols[4]])
+
+@nb.njit(fastmath=True, cache=True)
+def _to_uint16(value):
+    """Clip a value to the 16-bit range and truncate it to uint16."""
+    if value <= 0.0:
+        return np.uint16(0)
+    if value >= 65535.0:
+        return np.uint16(65535)
+    return np.uint16(value)
+
+@nb.njit(fastmath=True, cache=True)
+def _clamped_window(center, size):
+    """Coordinates of a 5-pixel window around center, clamped to [0, size). Replicates the edge pixels
+    the same way as np.pad(mode="edge"), without copying the mosaic."""
+    return (max(center - 2, 0), max(center - 1, 0), center, min(center + 1, size - 1), min(center + 2, size - 1))
+
+@nb.njit(fastmath=True, cache=True)
+def _vng_green(I, output, y, x, rows, cols, red_row, one):
+    """Interpolate a green site of the mosaic I and write it to output[:, y, x].
+
+    rows and cols are the (edge-clamped) coordinates of the 5x5 neighbourhood of the site.
+
+    The horizontal neighbours of a green site are red in a red row and blue in a
+    blue row; the vertical neighbours are the other color.
+    """
+    # Temporary variables (b: horizontal neighbours, r: vertical neighbours)
+    g1 , b1 , g2 , b2 , g3  = _neighbours(I, rows[0], cols, one)
+    r1 , g4 , r2 , g5 , r3  = _neighbours(I, rows[1], cols, one)
+    g6 , b3 , g7 , b4 , g8  = _neighbours(I, rows[2], cols, one)
+    r4 , g9 , r5 , g10, r6  = _neighbours(I, rows[3], cols, one)
+    g11, b5 , g12, b6 , g13 = _neighbours(I, rows[4], cols, one)
+    half, quarter = one/(one + one), one/(one + one + one + one) # Constants in the working precision
+    # Gradient calculation
+    grad_N = abs(r2-r5) + abs(g2-g7) + abs(g4-g9)*half + abs(g5-g10)*half + abs(b1-b3)*half + abs(b2-b4)*half
+    grad_E = abs(b4-b3) + abs(g8-g7) + abs(g5-g4)*half + abs(g10-g9)*half + abs(r3-r2)*half + abs(r6-r5)*half
+    grad_S = abs(r5-r2) + abs(g12-g7) + abs(g9-g4)*half + abs(g10-g5)*half + abs(b5-b3)*half + abs(b6-b4)*half
+    grad_W = abs(b3-b4) + abs(g6-g7) + abs(g4-g5)*half + abs(g9-g10)*half + abs(r1-r2)*half + abs(r4-r5)*half
+    grad_NE = abs(g5-g9) + abs(g3-g7) + abs(b2-b3) + abs(r3-r5)
+    grad_SE = abs(g10-g4) + abs(g13-g7) + abs(b6-b3) + abs(r6-r2)
+    grad_NW = abs(g4-g10) + abs(g1-g7) + abs(b1-b4) + abs(r1-r5)
+    grad_SW = abs(g9-g5) + abs(g11-g7) + abs(b5-b4) + abs(r4-r2)
+    # Threshold calculation
+    MAX = max(grad_N, grad_E, grad_S, grad_W, grad_NE, grad_SE, grad_NW, grad_SW)
+    MIN = min(grad_N, grad_E, grad_S, grad_W, grad_NE, grad_SE, grad_NW, grad_SW)
+    threshold = (one + half)*MIN + half*(MAX-MIN)
+    # Accumulate the directions below the threshold. The masks are multiplied in instead of
+    # branched on, as the outcome of each comparison is essentially random on noisy data.
+    m_N, m_E, m_S, m_W = (grad_N <= threshold)*one, (grad_E <= threshold)*one, (grad_S <= threshold)*one, (grad_W <= threshold)*one
+    m_NE, m_SE, m_NW, m_SW = (grad_NE <= threshold)*one, (grad_SE <= threshold)*one, (grad_NW <= threshold)*one, (grad_SW <= threshold)*one
+    cnt = m_N + m_E + m_S + m_W + m_NE + m_SE + m_NW + m_SW
+    sum_R = m_N*r2 + m_E*(r2+r3+r5+r6)*quarter + m_S*r5 + m_W*(r1+r2+r4+r5)*quarter + m_NE*(r2+r3)*half + m_SE*(r5+r6)*half + m_NW*(r1+r2)*half + m_SW*(r4+r5)*half
+    sum_G = m_N*(g2+g7)*half + m_E*(g8+g7)*half + m_S*(g12+g7)*half + m_W*(g6+g7)*half + m_NE*g5 + m_SE*g10 + m_NW*g4 + m_SW*g9
+    sum_B = m_N*(b1+b2+b3+b4)*quarter + m_E*b4 + m_S*(b3+b4+b5+b6)*quarter + m_W*b3 + m_NE*(b2+b4)*half + m_SE*(b4+b6)*half + m_NW*(b1+b3)*half + m_SW*(b3+b5)*half
+    horizontal = g7 + (sum_B - sum_G)/cnt
+    vertical = g7 + (sum_R - sum_G)/cnt
+    if red_row:
+        output[0, y, x] = _to_uint16(horizontal)
+        output[1, y, x] = _to_uint16(g7)
+        output[2, y, x] = _to_uint16(vertical)
+    else:
+        output[0, y, x] = _to_uint16(vertical)
+        output[1, y, x] = _to_uint16(g7)
+        output[2, y, x] = _to_uint16(horizontal)
+
+@nb.njit(fastmath=True, cache=True)
+def _vng_red_blue(I, output, y, x, rows, cols, red, one):
+    """Interpolate a red (red=True) or blue site of the mosaic I and write it to output[:, y, x].
+
+    rows and cols are the (edge-clamped) coordinates of the 5x5 neighbourhood of the site.
+    """
+    # Temporary variables (r: same color as the center, b: the opposite color on the diagonals)
+    r1 , g1 , r2 , g2 , r3  = _neighbours(I, rows[0], cols, one)
+    g3 , b1 , g4 , b2 , g5  = _neighbours(I, rows[1], cols, one)
+    r4 , g6 , r5 , g7 , r6  = _neighbours(I, rows[2], cols, one)
+    g8 , b3 , g9 , b4 , g10 = _neighbours(I, rows[3], cols, one)
+    r7 , g11, r8 , g12, r9  = _neighbours(I, rows[4], cols, one)
+    half, quarter = one/(one + one), one/(one + one + one + one) # Constants in the working precision
+    # Gradient calculation
+    grad_N = abs(g4-g9) + abs(r2-r5) + abs(b1-b3)*half + abs(b2-b4)*half + abs(g1-g6)*half + abs(g2-g7)*half
+    grad_E = abs(g7-g6) + abs(r6-r5) + abs(b2-b1)*half + abs(b4-b3)*half + abs(g5-g4)*half + abs(g10-g9)*half
+    grad_S = abs(g9-g4) + abs(r8-r5) + abs(b3-b1)*half + abs(b4-b2)*half + abs(g11-g6)*half + abs(g12-g7)*half
+    grad_W = abs(g6-g7) + abs(r4-r5) + abs(b1-b2)*half + abs(b3-b4)*half + abs(g3-g4)*half + abs(g8-g9)*half
+    grad_NE = abs(b2-b3) + abs(r3-r5) + abs(g4-g6)*half + abs(g7-g9)*half + abs(g2-g4)*half + abs(g5-g7)*half
+    grad_SE = abs(b4-b1) + abs(r9-r5) + abs(g7-g4)*half + abs(g9-g6)*half + abs(g10-g7)*half + abs(g12-g9)*half
+    grad_NW = abs(b1-b4) + abs(r1-r5) + abs(g4-g7)*half + abs(g6-g9)*half + abs(g1-g4)*half + abs(g3-g6)*half
+    grad_SW = abs(b3-b2) + abs(r7-r5) + abs(g6-g4)*half + abs(g9-g7)*half + abs(g8-g6)*half + abs(g11-g9)*half
+    # Threshold calculation
+    MAX = max(grad_N, grad_E, grad_S, grad_W, grad_NE, grad_SE, grad_NW, grad_SW)
+    MIN = min(grad_N, grad_E, grad_S, grad_W, grad_NE, grad_SE, grad_NW, grad_SW)
+    threshold = (one + half)*MIN + half*(MAX-MIN)
+    # Accumulate the directions below the threshold (see _vng_green)
+    m_N, m_E, m_S, m_W = (grad_N <= threshold)*one, (grad_E <= threshold)*one, (grad_S <= threshold)*one, (grad_W <= threshold)*one
+    m_NE, m_SE, m_NW, m_SW = (grad_NE <= threshold)*one, (grad_SE <= threshold)*one, (grad_NW <= threshold)*one, (grad_SW <= threshold)*one
+    cnt = m_N + m_E + m_S + m_W + m_NE + m_SE + m_NW + m_SW
+    sum_R = m_N*(r2+r5)*half + m_E*(r6+r5)*half + m_S*(r8+r5)*half + m_W*(r4+r5)*half + m_NE*(r3+r5)*half + m_SE*(r9+r5)*half + m_NW*(r1+r5)*half + m_SW*(r7+r5)*half
+    sum_G = m_N*g4 + m_E*g7 + m_S*g9 + m_W*g6 + m_NE*(g2+g4+g5+g7)*quarter + m_SE*(g7+g9+g10+g12)*quarter + m_NW*(g1+g3+g4+g6)*quarter + m_SW*(g6+g8+g9+g11)*quarter
+    sum_B = m_N*(b1+b2)*half + m_E*(b2+b4)*half + m_S*(b3+b4)*half + m_W*(b1+b3)*half + m_NE*b2 + m_SE*b4 + m_NW*b1 + m_SW*b3
+    green = r5 + (sum_G - sum_R)/cnt
+    opposite = r5 + (sum_B - sum_R)/cnt
+    if red:
+        output[0, y, x] = _to_uint16(r5)
+        output[1, y, x] = _to_uint16(green)
+        output[2, y, x] = _to_uint16(opposite)
+    else:
+        output[0, y, x] = _to_uint16(opposite)
+        output[1, y, x] = _to_uint16(green)
+        output[2, y, x] = _to_uint16(r5)
+
+@nb.njit(parallel=True, fastmath=True, cache=True, nogil=True)
+def _vng_interpolation(I, output, row_start, row_stop, red_row, red_col, one, tile_rows):
+    """VNG interpolation kernel, see debayer_VNG. Defined at module level so that numba
+    compiles it once per process and caches the machine code on disk. Rows row_start to
+    row_stop of the mosaic are split into blocks of tile_rows rows which are interpolated
+    in parallel, and written to output starting at its first row.
+
+    The CFA phase is given by the position (red_row, red_col) of the red site in the 2x2
+    Bayer tile, so the color of every site follows from the parity of its coordinates.
+    The arithmetic runs in the floating point type of one (float32 or float64), and the
+    result is clipped and written to the uint16 output directly. The GIL is released, so
+    other Python threads (e.g. reading the next frame) keep running during interpolation.
+    There is no progress reporting inside the kernel: callers that want progress debayer
+    in blocks of rows, see raw2fits.debayer.debayer_array.
+    """
+    height, width = I.shape
+    n_tiles = (row_stop - row_start + tile_rows - 1) // tile_rows
+    for tile in nb.prange(n_tiles): # Row blocks are independent, so each thread takes whole tiles
+        tile_start = row_start + tile*tile_rows
+        tile_stop = min(tile_start + tile_rows, row_stop)
+        for y in range(tile_start, tile_stop):
+            rows = _clamped_window(y, height) # Rows outside [row_start, row_stop) are read from the mosaic as halo
+            out_y = y - row_start
+            is_red_row = y % 2 == red_row
+            rb_col = red_col if is_red_row else 1 - red_col # Column parity of the red/blue site in this row
+            # Walk the row one 2x2 quad column at a time: one red/blue site and one green site
+            for x in range(0, width - 1, 2):
+                x_rb, x_g = x + rb_col, x + 1 - rb_col
+                _vng_red_blue(I, output, out_y, x_rb, rows, _clamped_window(x_rb, width), is_red_row, one)
+                _vng_green(I, output, out_y, x_g, rows, _clamped_window(x_g, width), is_red_row, one)
+            if width % 2 == 1: # Odd width, the last column has no partner
+                if rb_col == 0:
+                    _vng_red_blue(I, output, out_y, width - 1, rows, _clamped_window(width - 1, width), is_red_row, one)
+                else:
+                    _vng_green(I, output, out_y, width - 1, rows, _clamped_window(width - 1, width), is_red_row, one)
+    return output
+
+# Signatures compiled ahead of time by warmup(): (mosaic, output, first row, last row, red row, red column, precision,
+# tile rows). rawpy returns the visible area as a strided view of the full sensor, hence the non-contiguous
+# uint16 variant.
+_VNG_SIGNATURES = [
+    (mosaic, nb.uint16[:, :, ::1], nb.int64, nb.int64, nb.int64, nb.int64, precision, nb.int64)
+    for mosaic in (nb.uint16[:, :], nb.uint16[:, ::1], nb.float32[:, ::1])
+    for precision in (nb.float32, nb.float64)
+]
+
+def warmup():
+    """Compile the debayer kernels ahead of time.
+
+    The kernels are cached on disk, so only the first process on a machine pays the
+    compile cost. Calling this function is optional; it moves that cost out of the
+    first debayer call (e.g. to worker start-up).
+
+    """
+    for signature in _VNG_SIGNATURES:
+        _vng_interpolation.compile(signature)
+
+_VNG_TILE_ROWS = 32 # Rows per parallel work item in the VNG kernel
+
+
+def _num_threads(n_threads):
+    """Validate a requested thread count and clamp it to the size of numba's thread pool."""
+    if n_threads is None:
+        return nb.config.NUMBA_NUM_THREADS
+    if n_threads < 1:
+        raise ValueError(f"n_threads must be a positive integer, got {n_threads}.")
+    return min(int(n_threads), nb.config.NUMBA_NUM_THREADS)
+
+def debayer_VNG(bayer_img, bayer_pattern, n_threads=None, precision="float64", rows=None):
+    """Debayer a Bayer image using VNG interpolation.
+
+    Parameters
+    ----------
+    bayer_img : ndarray
+        Input Bayer image.
+    bayer_pattern : str
+        Bayer pattern of the top-left 2x2 tile, e.g. "RGGB".
+    n_threads : int, optional
+        Number of threads to use. Defaults to all available cores.
+    precision : str
+        Floating point precision of the interpolation, "float64" or "float32".
+    rows : tuple of int, optional
+        (start, stop) range of rows to debayer. The two rows of halo the interpolation needs
+        on either side are read from bayer_img. Defaults to all rows.
+
+    Returns
+    -------
+    output : ndarray
+        Output image, uint16, with the rows in the requested range.
+
+    """
+    # OpenCV's VNG interpolation is designed for 8-bit image, so we write the algorithm ourselves.
+    # To see VNG interpolation in action, see https://ui.adsabs.harvard.edu/abs/1999SPIE.3650...36C/abstract
+    # bayer_pattern lists the colors of the top-left 2x2 tile of bayer_img in row-major order, e.g. "RGGB".
+    # Return a 3D array of the same size as bayer_img, where the first dimension is the color channel (red, green, blue).
+    # The kernel is specialized on the position of the red site in the Bayer tile and derives the color of every
+    # other site from the parity of its coordinates.
+
+    # The kernel reads the mosaic in place (clamping at the borders instead of padding a copy) and writes clipped
+    # uint16 values directly, so the only allocation is the 6 bytes per pixel output.
+    if precision not in _PRECISIONS:
+        raise ValueError(f"Invalid precision {precision}. Must be one of {', '.join(_PRECISIONS)}.")
+    one = _PRECISIONS[precision](1.0) # Selects the working precision of the kernel
+    red_row, red_col = red_site(bayer_pattern) # CFA phase of the mosaic
+    row_start, row_stop = (0, bayer_img.shape[0]) if rows is None else rows
+    output = np.empty((3, row_stop - row_start, bayer_img.shape[1]), dtype=np.uint16) # Output image
+
+    previous_n_threads = nb.get_num_threads()
+    nb.set_num_threads(_num_threads(n_threads))
+    try:
+        return _vng_interpolation(I=bayer_img, output=output, row_start=row_start, row_stop=row_stop, red_row=red_row, red_col=red_col,
+                                  one=one, tile_rows=_VNG_TILE_ROWS)
+    finally:
+        nb.set_num_threads(previous_n_threads)
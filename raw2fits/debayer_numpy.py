@@ -0,0 +1,172 @@
+"""Debayer backends written with vectorized NumPy only.
+
+They need no JIT compilation, which makes them a good fit for short-lived jobs, and
+serve as a fallback where numba or OpenCV are not available. Rather than looping
+over pixels, every neighbour of a site is a strided view of the mosaic, and the
+gradients of all sites of one position in the 2x2 Bayer tile are computed at once.
+"""
+import numpy as np
+
+from raw2fits.cfa import red_site, strip_with_halo
+from raw2fits.debayer import _PRECISIONS
+
+
+_VNG_BLOCK_ROWS = 256 # Rows interpolated at once, bounds the size of the temporaries
+
+def _to_uint16(values):
+    """Clip to the 16-bit range and truncate to uint16, like the numba kernel."""
+    return np.clip(values, 0.0, 65535.0).astype(np.uint16)
+
+def _vng_green(n, red_row):
+    """VNG at green sites. n(dy, dx) returns the neighbours at offset (dy, dx) of all sites.
+    Same formulas as raw2fits.debayer_numba._vng_green. Returns the (red, green, blue) planes."""
+    g1 , b1 , g2 , b2 , g3  = (n(-2, dx) for dx in range(-2, 3))
+    r1 , g4 , r2 , g5 , r3  = (n(-1, dx) for dx in range(-2, 3))
+    g6 , b3 , g7 , b4 , g8  = (n( 0, dx) for dx in range(-2, 3))
+    r4 , g9 , r5 , g10, r6  = (n( 1, dx) for dx in range(-2, 3))
+    g11, b5 , g12, b6 , g13 = (n( 2, dx) for dx in range(-2, 3))
+    grad_N = abs(r2-r5) + abs(g2-g7) + abs(g4-g9)/2 + abs(g5-g10)/2 + abs(b1-b3)/2 + abs(b2-b4)/2
+    grad_E = abs(b4-b3) + abs(g8-g7) + abs(g5-g4)/2 + abs(g10-g9)/2 + abs(r3-r2)/2 + abs(r6-r5)/2
+    grad_S = abs(r5-r2) + abs(g12-g7) + abs(g9-g4)/2 + abs(g10-g5)/2 + abs(b5-b3)/2 + abs(b6-b4)/2
+    grad_W = abs(b3-b4) + abs(g6-g7) + abs(g4-g5)/2 + abs(g9-g10)/2 + abs(r1-r2)/2 + abs(r4-r5)/2
+    grad_NE = abs(g5-g9) + abs(g3-g7) + abs(b2-b3) + abs(r3-r5)
+    grad_SE = abs(g10-g4) + abs(g13-g7) + abs(b6-b3) + abs(r6-r2)
+    grad_NW = abs(g4-g10) + abs(g1-g7) + abs(b1-b4) + abs(r1-r5)
+    grad_SW = abs(g9-g5) + abs(g11-g7) + abs(b5-b4) + abs(r4-r2)
+    m_N, m_E, m_S, m_W, m_NE, m_SE, m_NW, m_SW, cnt = _masks(g7.dtype, grad_N, grad_E, grad_S, grad_W, grad_NE, grad_SE, grad_NW, grad_SW)
+    sum_R = m_N*r2 + m_E*(r2+r3+r5+r6)/4 + m_S*r5 + m_W*(r1+r2+r4+r5)/4 + m_NE*(r2+r3)/2 + m_SE*(r5+r6)/2 + m_NW*(r1+r2)/2 + m_SW*(r4+r5)/2
+    sum_G = m_N*(g2+g7)/2 + m_E*(g8+g7)/2 + m_S*(g12+g7)/2 + m_W*(g6+g7)/2 + m_NE*g5 + m_SE*g10 + m_NW*g4 + m_SW*g9
+    sum_B = m_N*(b1+b2+b3+b4)/4 + m_E*b4 + m_S*(b3+b4+b5+b6)/4 + m_W*b3 + m_NE*(b2+b4)/2 + m_SE*(b4+b6)/2 + m_NW*(b1+b3)/2 + m_SW*(b3+b5)/2
+    horizontal = g7 + (sum_B - sum_G)/cnt
+    vertical = g7 + (sum_R - sum_G)/cnt
+    return (horizontal, g7, vertical) if red_row else (vertical, g7, horizontal)
+
+def _vng_red_blue(n, red):
+    """VNG at red (red=True) or blue sites, see _vng_green."""
+    r1 , g1 , r2 , g2 , r3  = (n(-2, dx) for dx in range(-2, 3))
+    g3 , b1 , g4 , b2 , g5  = (n(-1, dx) for dx in range(-2, 3))
+    r4 , g6 , r5 , g7 , r6  = (n( 0, dx) for dx in range(-2, 3))
+    g8 , b3 , g9 , b4 , g10 = (n( 1, dx) for dx in range(-2, 3))
+    r7 , g11, r8 , g12, r9  = (n( 2, dx) for dx in range(-2, 3))
+    grad_N = abs(g4-g9) + abs(r2-r5) + abs(b1-b3)/2 + abs(b2-b4)/2 + abs(g1-g6)/2 + abs(g2-g7)/2
+    grad_E = abs(g7-g6) + abs(r6-r5) + abs(b2-b1)/2 + abs(b4-b3)/2 + abs(g5-g4)/2 + abs(g10-g9)/2
+    grad_S = abs(g9-g4) + abs(r8-r5) + abs(b3-b1)/2 + abs(b4-b2)/2 + abs(g11-g6)/2 + abs(g12-g7)/2
+    grad_W = abs(g6-g7) + abs(r4-r5) + abs(b1-b2)/2 + abs(b3-b4)/2 + abs(g3-g4)/2 + abs(g8-g9)/2
+    grad_NE = abs(b2-b3) + abs(r3-r5) + abs(g4-g6)/2 + abs(g7-g9)/2 + abs(g2-g4)/2 + abs(g5-g7)/2
+    grad_SE = abs(b4-b1) + abs(r9-r5) + abs(g7-g4)/2 + abs(g9-g6)/2 + abs(g10-g7)/2 + abs(g12-g9)/2
+    grad_NW = abs(b1-b4) + abs(r1-r5) + abs(g4-g7)/2 + abs(g6-g9)/2 + abs(g1-g4)/2 + abs(g3-g6)/2
+    grad_SW = abs(b3-b2) + abs(r7-r5) + abs(g6-g4)/2 + abs(g9-g7)/2 + abs(g8-g6)/2 + abs(g11-g9)/2
+    m_N, m_E, m_S, m_W, m_NE, m_SE, m_NW, m_SW, cnt = _masks(r5.dtype, grad_N, grad_E, grad_S, grad_W, grad_NE, grad_SE, grad_NW, grad_SW)
+    sum_R = m_N*(r2+r5)/2 + m_E*(r6+r5)/2 + m_S*(r8+r5)/2 + m_W*(r4+r5)/2 + m_NE*(r3+r5)/2 + m_SE*(r9+r5)/2 + m_NW*(r1+r5)/2 + m_SW*(r7+r5)/2
+    sum_G = m_N*g4 + m_E*g7 + m_S*g9 + m_W*g6 + m_NE*(g2+g4+g5+g7)/4 + m_SE*(g7+g9+g10+g12)/4 + m_NW*(g1+g3+g4+g6)/4 + m_SW*(g6+g8+g9+g11)/4
+    sum_B = m_N*(b1+b2)/2 + m_E*(b2+b4)/2 + m_S*(b3+b4)/2 + m_W*(b1+b3)/2 + m_NE*b2 + m_SE*b4 + m_NW*b1 + m_SW*b3
+    green = r5 + (sum_G - sum_R)/cnt
+    opposite = r5 + (sum_B - sum_R)/cnt
+    return (r5, green, opposite) if red else (opposite, green, r5)
+
+def _masks(dtype, *gradients):
+    """Return the 0/1 weight of each direction whose gradient is within the VNG threshold, and their count."""
+    MAX = np.maximum.reduce(gradients)
+    MIN = np.minimum.reduce(gradients)
+    threshold = 1.5*MIN + 0.5*(MAX-MIN)
+    masks = [(gradient <= threshold).astype(dtype) for gradient in gradients]
+    return (*masks, sum(masks))
+
+def debayer_VNG(bayer_img, bayer_pattern, rows=None, precision="float64"):
+    """Debayer a Bayer image using VNG interpolation, vectorized with NumPy.
+
+    Same algorithm and output as the numba kernel (up to rounding differences of 1 ADU),
+    see raw2fits.debayer_numba.debayer_VNG for the parameters.
+
+    """
+    if precision not in _PRECISIONS:
+        raise ValueError(f"Invalid precision {precision}. Must be one of {', '.join(_PRECISIONS)}.")
+    dtype = _PRECISIONS[precision]
+    red_row, red_col = red_site(bayer_pattern)
+    height, width = bayer_img.shape
+    row_start, row_stop = (0, height) if rows is None else rows
+    output = np.empty((3, row_stop - row_start, width), dtype=np.uint16)
+    col_index = np.clip(np.arange(-2, width + 2), 0, width - 1)
+
+    for block_start in range(row_start, row_stop, _VNG_BLOCK_ROWS):
+        block_stop = min(block_start + _VNG_BLOCK_ROWS, row_stop)
+        # The block with 2 pixels of context on each side; rows and columns outside the mosaic replicate its edge
+        row_index = np.clip(np.arange(block_start - 2, block_stop + 2), 0, height - 1)
+        padded = bayer_img[row_index][:, col_index].astype(dtype)
+        block = output[:, block_start - row_start:block_stop - row_start]
+        for row_parity in (0, 1):
+            y0 = (row_parity - block_start) % 2 # First row of the block with this parity
+            is_red_row = row_parity == red_row
+            for col_parity in (0, 1):
+                sites = block[:, y0::2, col_parity::2]
+                if sites.size == 0:
+                    continue
+                n_y, n_x = sites.shape[1:]
+                def n(dy, dx):
+                    return padded[2 + y0 + dy::2, 2 + col_parity + dx::2][:n_y, :n_x]
+                if col_parity == (red_col if is_red_row else 1 - red_col):
+                    planes = _vng_red_blue(n, is_red_row)
+                else:
+                    planes = _vng_green(n, is_red_row)
+                for channel, plane in enumerate(planes):
+                    sites[channel] = _to_uint16(plane)
+    return output
+
+def debayer_bilinear(bayer_img, bayer_pattern, rows=None):
+    """Debayer a Bayer image using bilinear interpolation, vectorized with NumPy.
+
+    Every missing color is the mean of its nearest neighbours of that color (2 or 4 of
+    them), computed as a normalized convolution so that the borders need no special case.
+
+    """
+    red_row, red_col = red_site(bayer_pattern)
+    strip, crop = strip_with_halo(bayer_img, rows, halo=2)
+    height, width = strip.shape
+    sites = np.zeros((3, height, width), dtype=bool)
+    sites[0, red_row::2, red_col::2] = True
+    sites[2, 1 - red_row::2, 1 - red_col::2] = True
+    sites[1] = ~(sites[0] | sites[2])
+
+    values = np.pad(strip.astype(np.float32), 1) * np.pad(sites, ((0, 0), (1, 1), (1, 1)))
+    weights = np.pad(sites, ((0, 0), (1, 1), (1, 1))).astype(np.float32)
+    kernel = ((1, 2, 1), (2, 4, 2), (1, 2, 1))
+    value_sum, weight_sum = np.zeros((3, height, width), np.float32), np.zeros((3, height, width), np.float32)
+    for dy in range(3):
+        for dx in range(3):
+            value_sum += kernel[dy][dx]*values[:, dy:dy + height, dx:dx + width]
+            weight_sum += kernel[dy][dx]*weights[:, dy:dy + height, dx:dx + width]
+    output = np.where(sites, strip, np.floor(value_sum/weight_sum + 0.5)) # Keep the measured color, round the rest
+    return output[:, crop].astype(np.uint16)
+
+def debayer_superpixel(bayer_img, bayer_pattern, rows=None):
+    """Debayer a Bayer image by collapsing each 2x2 Bayer tile into one RGB pixel.
+
+    The output has half the resolution of the mosaic (odd trailing rows and columns are
+    dropped); green is the mean of the two green sites. No interpolation is involved,
+    which makes this an order of magnitude faster than VNG, e.g. for previews.
+
+    Parameters
+    ----------
+    bayer_img : ndarray
+        Input Bayer image.
+    bayer_pattern : str
+        Bayer pattern of the top-left 2x2 tile, e.g. "RGGB".
+    rows : tuple of int, optional
+        (start, stop) range of mosaic rows to debayer, start must be even. Defaults to all rows.
+
+    Returns
+    -------
+    output : ndarray
+        Output image, uint16, shape (3, rows/2, width/2).
+
+    """
+    red_row, red_col = red_site(bayer_pattern)
+    row_start, row_stop = (0, bayer_img.shape[0]) if rows is None else rows
+    row_stop = row_start + (min(row_stop, bayer_img.shape[0]) - row_start) // 2 * 2
+    width = bayer_img.shape[1] // 2 * 2
+    tiles = bayer_img[row_start:row_stop, :width].reshape((row_stop - row_start) // 2, 2, width // 2, 2)
+    output = np.empty((3, tiles.shape[0], tiles.shape[2]), dtype=np.uint16)
+    output[0] = tiles[:, red_row, :, red_col]
+    output[1] = (tiles[:, red_row, :, 1 - red_col].astype(np.uint32) + tiles[:, 1 - red_row, :, red_col] + 1) // 2
+    output[2] = tiles[:, 1 - red_row, :, 1 - red_col]
+    return output
@@ -0,0 +1,48 @@
+"""Debayer backends using OpenCV's bilinear and edge-aware demosaicing."""
+import cv2
+import numpy as np
+
+from raw2fits.cfa import strip_with_halo
+
+
+# OpenCV conversion codes (bilinear, edge-aware) per Bayer pattern. OpenCV names the patterns after the
+# second row, e.g. COLOR_BayerBG is an RGGB mosaic.
+_OPENCV_CODES = {
+    "RGGB": (cv2.COLOR_BayerBG2RGB, cv2.COLOR_BayerBG2RGB_EA),
+    "BGGR": (cv2.COLOR_BayerRG2RGB, cv2.COLOR_BayerRG2RGB_EA),
+    "GRBG": (cv2.COLOR_BayerGB2RGB, cv2.COLOR_BayerGB2RGB_EA),
+    "GBRG": (cv2.COLOR_BayerGR2RGB, cv2.COLOR_BayerGR2RGB_EA),
+}
+_OPENCV_HALO = 4 # Rows of context around a strip for OpenCV's debayering (even, to keep the CFA phase)
+
+def _debayer(bayer_img, bayer_pattern, rows, edge_aware):
+    """Debayer rows of a Bayer image with OpenCV, see debayer_bilinear."""
+    if bayer_pattern not in _OPENCV_CODES:
+        raise ValueError(f"Bayer pattern {bayer_pattern} does not support.")
+    strip, crop = strip_with_halo(bayer_img, rows, halo=_OPENCV_HALO) # Debayer with a halo of context rows, then drop it
+    output = cv2.cvtColor(strip, _OPENCV_CODES[bayer_pattern][edge_aware]) # Use OpenCV's debayering function
+    return np.moveaxis(output, -1, 0)[:, crop] # Move color channel axis to the front
+
+def debayer_bilinear(bayer_img, bayer_pattern, rows=None):
+    """Debayer a Bayer image using bilinear interpolation.
+
+    Parameters
+    ----------
+    bayer_img : ndarray
+        Input Bayer image.
+    bayer_pattern : str
+        Bayer pattern of the top-left 2x2 tile, e.g. "RGGB".
+    rows : tuple of int, optional
+        (start, stop) range of rows to debayer. Defaults to all rows.
+
+    Returns
+    -------
+    output : ndarray
+        Output image.
+
+    """
+    return _debayer(bayer_img, bayer_pattern, rows, edge_aware=False)
+
+def debayer_edge_aware(bayer_img, bayer_pattern, rows=None):
+    """Debayer a Bayer image using OpenCV's edge-aware interpolation, see debayer_bilinear."""
+    return _debayer(bayer_img, bayer_pattern, rows, edge_aware=True)
@@ -0,0 +1,112 @@
+import functools
+
+import numpy as np
+
+from raw2fits import __version__
+
+
+COMPRESSION_TYPES = ("RICE_1", "GZIP_1", "GZIP_2", "HCOMPRESS_1") # Lossless for integer data
+_BLOCK_ROWS = 64 # Rows converted to big-endian int16 at a time
+
+
+@functools.lru_cache(maxsize=None)
+def _header_template():
+    from astropy.io import fits
+
+    header = fits.PrimaryHDU(np.zeros((3, 1, 1), dtype=np.uint16)).header
+    header.comments["NAXIS"] = "Dimensionality"
+    header.comments["EXTEND"] = "Extensions are permitted"
+    header["SWCREATE"] = (f"raw2fits v{__version__}", "Software used to create this file")
+    return header
+
+def header_template():
+    """Return a new primary header for a uint16 image, with the frame-independent keywords set.
+
+    The template is built once per process and copied, which is much cheaper than
+    constructing a header (and an HDU) for every frame. It holds the structural keywords
+    and SWCREATE; the NAXISn keywords are set when the image is written.
+    """
+    return _header_template().copy()
+
+def write_fits_strips(path, header, shape, strips, overwrite=True):
+    """Write a uint16 image to a FITS file strip by strip.
+
+    The file is preallocated at its full size and each strip is written straight into
+    its place in the data section. Only one strip needs to be in memory at a time, and
+    unlike a writable memory map, written strips do not stay resident in the process.
+    A whole image can be written as a single strip, [(0, image)]: it is converted to the
+    FITS byte order a few rows at a time, so no full-size copy is made.
+
+    Parameters
+    ----------
+    path : str
+        Path of the FITS file.
+    header : astropy.io.fits.Header
+        Primary header. The NAXISn and BSCALE/BZERO keywords are set from shape.
+    shape : tuple of int
+        Shape of the full image, (channels, height, width).
+    strips : iterable
+        (row_start, strip) pairs, where strip is a uint16 array of shape (channels, rows, width),
+        e.g. from `raw2fits.debayer.debayer_strips`.
+    overwrite : bool
+        Overwrite path if it exists.
+
+    """
+    header = header.copy()
+    header["BITPIX"] = 16
+    header["NAXIS"] = len(shape)
+    for axis, length in enumerate(reversed(shape), start=1):
+        header[f"NAXIS{axis}"] = length
+    # FITS has no unsigned 16-bit type: uint16 is stored as int16 with an offset of 32768
+    header.set("BSCALE", 1, after="EXTEND" if "EXTEND" in header else f"NAXIS{len(shape)}")
+    header.set("BZERO", 32768, after="BSCALE")
+    header_bytes = header.tostring().encode("ascii") # Padded to whole 2880-byte FITS blocks
+
+    data_bytes = int(np.prod(shape))*2
+    padded_bytes = -(-data_bytes // 2880)*2880 # The data section is padded to whole 2880-byte FITS blocks
+    channels, height, width = shape
+    with open(path, "wb" if overwrite else "xb") as f:
+        f.write(header_bytes)
+        f.truncate(len(header_bytes) + padded_bytes) # Preallocate the data section
+        buffer = np.empty((_BLOCK_ROWS, width), dtype=np.uint16) # Reused for every block of rows
+        for row_start, strip in strips:
+            for channel in range(channels): # The rows of a strip are contiguous within each channel plane
+                f.seek(len(header_bytes) + ((channel*height + row_start)*width)*2)
+                for block_start in range(0, strip.shape[1], _BLOCK_ROWS):
+                    rows = strip[channel, block_start:block_start + _BLOCK_ROWS]
+                    block = buffer[:rows.shape[0]]
+                    # Flipping the sign bit maps uint16 to int16 - 32768, which is then stored big-endian
+                    np.bitwise_xor(rows, np.uint16(0x8000), out=block)
+                    block.byteswap(inplace=True)
+                    f.write(block)
+
+def write_fits_compressed(path, header, image, compression="RICE_1", overwrite=True):
+    """Write a uint16 image to a tile-compressed FITS file.
+
+    The image is stored losslessly in a compressed image extension (one tile per row, as
+    fpack does) after an empty primary HDU. astropy and most FITS readers decompress it
+    transparently.
+
+    Parameters
+    ----------
+    path : str
+        Path of the FITS file.
+    header : astropy.io.fits.Header
+        Header of the image, e.g. from header_template. Its structural keywords are replaced.
+    image : ndarray
+        The uint16 image.
+    compression : str
+        Compression algorithm, one of COMPRESSION_TYPES.
+    overwrite : bool
+        Overwrite path if it exists.
+
+    """
+    from astropy.io import fits
+
+    if compression not in COMPRESSION_TYPES:
+        raise ValueError(f"Invalid compression {compression}. Must be one of {', '.join(COMPRESSION_TYPES)}.")
+    header = header.copy()
+    for keyword in ("SIMPLE", "EXTEND", "BSCALE", "BZERO"): # Set by the HDUs themselves
+        header.remove(keyword, ignore_missing=True)
+    hdu = fits.CompImageHDU(image, header=header, compression_type=compression)
+    fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(path, overwrite=overwrite)
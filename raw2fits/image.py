@@ -1,55 +1,234 @@
-from raw2fits.debayer import *
-import rawpy
-import exifread
-from astropy.io import fits
-from datetime import datetime, timezone
+import os
+from raw2fits import instrument
+from raw2fits.cache import DebayerCache, buffer_digest, file_digest
+from raw2fits.calibration import load_calibration
+from raw2fits.cfa import bin_cfa, binned_shape, roi_origin, snap_roi
+from raw2fits.debayer import _PRECISIONS, debayer_array, debayer_strips, output_scale, output_shape, select_engine
+from raw2fits.fitsio import header_template, write_fits_compressed, write_fits_strips
+from raw2fits.raw import observation_dates, raw_image_size, read_exif, read_file, read_raw
 
 class Image():
-    def __init__(self, path, debayer_method="VNG"):
+    def __init__(self, path, debayer_method="VNG", n_threads=None, precision="float64", defer=True, engine=None, calibration=None, cache=None,
+                 binning=1, roi=None):
+        """
+        path: path to the raw image.
+        debayer_method: "VNG", "Bilinear", "EdgeAware" or "Superpixel" (half resolution), see raw2fits.debayer.backends().
+        n_threads: number of threads used by the VNG kernel. Defaults to all available cores.
+        precision: floating point precision of the VNG kernel, "float64" or "float32".
+        defer: if False, read and debayer the image right away. By default bayer_image, debayer_image, exif and
+            image_size are computed on first access, so that e.g. reading image_size does not decode the image.
+        engine: preferred debayer implementation, "numba", "numpy" or "opencv". Defaults to the method's default.
+        calibration: raw2fits.calibration.Calibration, or path to masters saved with Calibration.save, applied to the
+            Bayer mosaic before debayering.
+        cache: raw2fits.cache.DebayerCache, or path to its directory. Debayered images are stored there and reused
+            for raw files with the same contents, debayer settings and calibration.
+        binning: CFA binning factor, e.g. 2 for 2x2 binning. Same-color sites are averaged after calibration and
+            before debayering (see raw2fits.cfa.bin_cfa), so only the binned mosaic is debayered.
+        roi: (x, y, width, height) region of interest of the mosaic, in unbinned pixels. It is snapped to whole
+            Bayer tiles and cropped before calibration and binning, so only the region is calibrated and debayered.
+        """
         # Check file existence
         if not os.path.exists(path):
             raise FileNotFoundError(f"File {path} does not exist.")
         self.file_extension = os.path.splitext(path)[1]
+        # Check the settings now, as the image may only be debayered much later, e.g. in a worker process
+        select_engine(debayer_method, engine)
+        if precision not in _PRECISIONS:
+            raise ValueError(f"Invalid precision {precision}. Must be one of {', '.join(_PRECISIONS)}.")
         # Initialize attributes
         self.path = path
         self.debayer_method = debayer_method
-        print("Reading image...")
-        self.bayer_image = self._get_bayer_image(path)
-        self.image_size = self.bayer_image.shape
-        print(f"Debayering ({self.debayer_method}, {self.image_size[0]} x {self.image_size[1]})...")
-        self.debayer_image = self._get_debayer_image(path, debayer_method)
-        self.exif = self._get_exif(path)
+        self.engine = engine
+        self.n_threads = n_threads
+        self.precision = precision
+        self.calibration = load_calibration(calibration)
+        self.cache = DebayerCache(cache) if isinstance(cache, str) else cache
+        if binning < 1 or int(binning) != binning:
+            raise ValueError(f"The binning factor must be a positive integer, got {binning}.")
+        self.binning = int(binning)
+        self.roi = tuple(roi) if roi is not None else None
+        self._bayer_image = None
+        self._bayer_pattern = None
+        self._exif = None
+        self._image_size = None
+        self._debayer_image = None
+        self._digest = None # Hash of the raw file, the part of the cache key that depends on the file
+        if not defer:
+            self.read()
+            self.debayer()
         pass
 
+    @property
+    def bayer_image(self):
+        """The (calibrated) Bayer mosaic, read on first access."""
+        if self._bayer_image is None:
+            self.read()
+        return self._bayer_image
+
+    @property
+    def bayer_pattern(self):
+        """Bayer pattern of the mosaic, e.g. "RGGB". LibRaw only knows it after decoding the image."""
+        if self._bayer_pattern is None:
+            self.read()
+        return self._bayer_pattern
+
+    @property
+    def exif(self):
+        """EXIF tags, read on first access. Only the tags are parsed if the mosaic has not been read."""
+        if self._exif is None:
+            self._exif = read_exif(self.path)
+        return self._exif
+
+    @property
+    def image_size(self):
+        """(height, width) of the Bayer mosaic after the region of interest and binning, from the metadata
+        of the raw file if it has not been read."""
+        if self._image_size is None:
+            self._image_size = self._reduced_shape(raw_image_size(self.path))
+        return self._image_size
+
+    def _reduced_shape(self, shape):
+        """Shape of a full mosaic of shape shape after the region of interest and binning."""
+        if self.roi is not None:
+            rows, cols = snap_roi(shape, self.roi)
+            shape = (rows.stop - rows.start, cols.stop - cols.start)
+        return binned_shape(shape, self.binning)
+
+    @property
+    def debayer_image(self):
+        """The debayered image, computed (or loaded from the cache) on first access."""
+        if self._debayer_image is None:
+            self.debayer()
+        return self._debayer_image
+
+    def read(self, buffer=None):
+        """Read the Bayer mosaic, its Bayer pattern and the EXIF tags from the raw file, or from buffer,
+        its contents if they have already been read. With a cache, the file is hashed from the same buffer."""
+        if buffer is None:
+            buffer = read_file(self.path)
+        if self.cache is not None and self._digest is None:
+            self._digest = buffer_digest(buffer)
+        frame = read_raw(self.path, buffer) # Mosaic, Bayer pattern and EXIF from a single read of the file
+        self._bayer_image = frame.bayer_image
+        self._bayer_pattern = frame.bayer_pattern
+        self._exif = frame.exif
+        region = None # (rows, columns) of the region of interest in the full mosaic
+        if self.roi is not None:
+            region = snap_roi(frame.bayer_image.shape, self.roi)
+            self._bayer_image = frame.bayer_image[region].copy() # Copy, so that the full mosaic is freed
+        if self.calibration is not None:
+            with instrument.span("calibrate", self.path, pixels=self._bayer_image.size):
+                # In place, before debayering, with the masters cropped like the mosaic
+                self.calibration.apply(self._bayer_image, self._bayer_pattern, out=self._bayer_image, region=region)
+        if self.binning > 1:
+            with instrument.span("bin", self.path, pixels=self._bayer_image.size):
+                self._bayer_image = bin_cfa(self._bayer_image, self.binning)
+        self._image_size = self._bayer_image.shape
+
+    def _cache_key(self, buffer=None):
+        """Key of the debayered image in the cache. The file is hashed from buffer, its contents, if given."""
+        if self._digest is None:
+            self._digest = buffer_digest(buffer) if buffer is not None else file_digest(self.path)
+        return self.cache.key(self._digest, self.debayer_method, select_engine(self.debayer_method, self.engine),
+                              self.precision, self.calibration, self.binning, self.roi)
+
+    def prefetch(self):
+        """Read what debayer() will need from the raw file, e.g. in a reader thread: the mosaic, unless the
+        debayered image is in the cache. The file is read only once, for both its hash and the mosaic."""
+        if self.cache is None:
+            self.read()
+            return
+        buffer = read_file(self.path) if self._digest is None and self._bayer_image is None else None
+        if self._cache_key(buffer) not in self.cache and self._bayer_image is None:
+            self.read(buffer)
+        elif buffer is not None and self._exif is None:
+            self._exif = read_exif(self.path, buffer) # Needed for the header, parsed from the buffer already read
+
+    def debayer(self):
+        """Debayer the mosaic, reading it first if needed, or load the result from the cache."""
+        key = None
+        buffer = None
+        if self.cache is not None:
+            if self._digest is None and self._bayer_image is None:
+                buffer = read_file(self.path) # Read once, for the hash and, if the image is not cached, the mosaic
+            with instrument.span("cache", self.path) as counts:
+                key = self._cache_key(buffer)
+                self._debayer_image = self.cache.load(key)
+                if self._debayer_image is not None:
+                    counts["bytes"] = self._debayer_image.nbytes
+            if self._debayer_image is not None:
+                if buffer is not None and self._exif is None:
+                    self._exif = read_exif(self.path, buffer) # Needed for the header, parsed from the buffer already read
+                return
+        if self._bayer_image is None:
+            self.read(buffer)
+        bayer_image = self._bayer_image
+        with instrument.span("debayer", self.path, pixels=bayer_image.size) as counts:
+            self._debayer_image = debayer_array(bayer_image, self.bayer_pattern, method=self.debayer_method, engine=self.engine, n_threads=self.n_threads, precision=self.precision)
+            counts["bytes"] = self._debayer_image.nbytes
+        if key is not None:
+            self.cache.store(key, self._debayer_image)
+
+    def release(self):
+        """Free the Bayer mosaic and the debayered image. They are read and computed again on next access."""
+        self._bayer_image = None
+        self._bayer_pattern = None
+        self._debayer_image = None
+
     def __repr__(self):
         return f"Image(path={self.path}, debayer_method={self.debayer_method})"\
         
     def __str__(self):
         return f"Image(path={self.path}, debayer_method={self.debayer_method})"
     
-    def _get_bayer_image(self, path):
-        return rawpy.imread(path).raw_image_visible
+    def save_fits(self, image_type, path=None, strip_rows=None, compress=None):
+        """
+        Save the image as a FITS file.
+        image_type: "LIGHT", "DARK", "FLAT", "BIAS"
+        path: path to save the file to. If None, save to the same directory as the image.
+        strip_rows: if given, the image has not been debayered yet and no cache is used,
+            debayer it in strips of this many rows and write each strip straight into the file,
+            so the full debayered image is never held in memory.
+        compress: if given, write a tile-compressed FITS file with this algorithm, e.g. "RICE_1"
+            (see raw2fits.fitsio.COMPRESSION_TYPES). Needs the whole debayered image in memory.
+        Building the header and writing the file are reported as the "header" and "write" spans of
+        raw2fits.instrument. When streaming, the "write" span includes debayering the strips.
+        """
+        # Without a cache, strips are debayered straight into the file (unless compressing, which needs the whole image)
+        streaming = strip_rows is not None and self._debayer_image is None and compress is None and self.cache is None
+        if streaming:
+            if self._bayer_image is None:
+                self.read() # One pass over the file for the mosaic and the EXIF
+        else:
+            image = self.debayer_image
+        with instrument.span("header", self.path):
+            header = self.fits_header(image_type)
 
-    def _get_debayer_image(self, path, debayer_method):
-        return debayer(path, method=debayer_method)
+        if path is None:
+            path = self.path.replace(self.file_extension, ".fits")
+        else:
+            path = os.path.join(path, self.path.split("/")[-1].replace(self.file_extension, ".fits"))
 
-    def _get_exif(self, path):
-        return exifread.process_file(open(path, 'rb')) 
+        shape = output_shape(self.image_size, self.debayer_method) if streaming else image.shape
+        with instrument.span("write", path, pixels=shape[1]*shape[2]) as counts:
+            if compress is not None:
+                write_fits_compressed(path, header, image, compression=compress)
+            elif streaming:
+                strips = debayer_strips(self.bayer_image, self.bayer_pattern, strip_rows, method=self.debayer_method, engine=self.engine, n_threads=self.n_threads, precision=self.precision)
+                write_fits_strips(path, header, shape, strips)
+            else:
+                write_fits_strips(path, header, shape, [(0, image)]) # Straight from the debayer buffer
+            counts["bytes"] = os.path.getsize(path)
+        pass
 
-    def save_fits(self, image_type, path=None):
+    def fits_header(self, image_type):
         """
-        Save the image as a FITS file.
+        Return the FITS header of the image, with the keywords derived from the EXIF tags.
         image_type: "LIGHT", "DARK", "FLAT", "BIAS"
-        path: path to save the file to. If None, save to the same directory as the image.
         """
-        hdu = fits.PrimaryHDU(self.debayer_image)
-        hdul = fits.HDUList([hdu])
+        header = header_template() # Frame-independent keywords, built once per process
 
         # Add EXIF data to FITS header
-        header = hdul[0].header
-
-        header.comments["NAXIS"] = "Dimensionality"
-        header.comments["EXTEND"] = "Extensions are permitted"
 
         if image_type in ["LIGHT", "DARK", "FLAT", "BIAS"]:
             header["IMAGETYP"] = image_type
@@ -68,28 +247,30 @@ class Image():
             header.comments["EXPSURE"] = "[s] Exposure duration"
             header.comments["EXPTIME"]= "[s] Exposure duration"
 
-        if "Image DateTime" in self.exif:
-            dt_str = self.exif["Image DateTime"].printable # datetime string
-            if "EXIF OffsetTime" in self.exif: # timezone
-                tz_str = self.exif["EXIF OffsetTime"].printable # timezone string
-                dt = datetime.strptime(dt_str+tz_str, "%Y:%m:%d %H:%M:%S%z") # datetime object
-                dt_utc = dt.astimezone(timezone.utc) # datetime object in UTC
-                header["DATE-LOC"] = dt.replace(tzinfo=None).isoformat()
-                header["DATE-OBS"] = dt_utc.replace(tzinfo=None).isoformat()
-                header.comments["DATE-LOC"] = "Time of observation (local)"
-                header.comments["DATE-OBS"] = "Time of observation (UTC)"
-            else:
-                dt = datetime.strptime(dt_str, "%Y:%m:%d %H:%M:%S") # datetime object
-                header["DATE-LOC"] = dt.replace(tzinfo=None).isoformat()
-                header["DATE-OBS"] = dt.replace(tzinfo=None).isoformat()
-                header.comments["DATE-LOC"] = "Time of observation (local)"
-                header.comments["DATE-OBS"] = "Time of observation (local)"
-
-        header["XBINNING"] = 1
-        header["YBINNING"] = 1
+        date_loc, date_utc = observation_dates(self.exif)
+        if date_loc is not None:
+            header["DATE-LOC"] = date_loc
+            header["DATE-OBS"] = date_utc or date_loc # The local time if the EXIF has no time zone
+            header.comments["DATE-LOC"] = "Time of observation (local)"
+            header.comments["DATE-OBS"] = "Time of observation (UTC)" if date_utc else "Time of observation (local)"
+
+        if self.calibration is not None:
+            header["CALSTAT"] = self.calibration.calstat
+            header.comments["CALSTAT"] = "Calibration applied (Bias, Dark, Flat)"
+
+        binning = self.binning*output_scale(self.debayer_method) # Superpixel debayering bins 2x2 on top of the CFA binning
+        header["XBINNING"] = binning
+        header["YBINNING"] = binning
         header.comments["XBINNING"] = "X axis binning factor"
         header.comments["YBINNING"] = "Y axis binning factor"
 
+        if self.roi is not None:
+            row_start, col_start = roi_origin(self.roi) # Known without reading the file, e.g. for images loaded from the cache
+            header["XORGSUBF"] = col_start // binning
+            header["YORGSUBF"] = row_start // binning
+            header.comments["XORGSUBF"] = "Subframe X origin in binned pixels"
+            header.comments["YORGSUBF"] = "Subframe Y origin in binned pixels"
+
         if "EXIF ISOSpeedRatings" in self.exif:
             header["GAIN"] = int(self.exif["EXIF ISOSpeedRatings"].printable)
             header.comments["GAIN"] = "Sensor gain (ISO)"
@@ -99,10 +280,8 @@ class Image():
             yv1, yv2 = self.exif["EXIF FocalPlaneYResolution"].printable.split("/")
             dpi_x = float(xv1)/float(xv2)
             dpi_y = float(yv1)/float(yv2)
-            sensor_size_x = self.image_size[1] / dpi_x * 25.4 # mm
-            sensor_size_y = self.image_size[0] / dpi_y * 25.4 # mm
-            pixel_scale_x = sensor_size_x / self.image_size[1] * 1000 # um
-            pixel_scale_y = sensor_size_y / self.image_size[0] * 1000 # um
+            pixel_scale_x = 25.4 / dpi_x * 1000 * binning # um, of a binned pixel
+            pixel_scale_y = 25.4 / dpi_y * 1000 * binning # um
             header["XPIXSZ"] = pixel_scale_x
             header["YPIXSZ"] = pixel_scale_y
             header.comments["XPIXSZ"] = "[um] Pixel X axis size"
@@ -129,21 +308,4 @@ class Image():
             header["OBSERVER"] = self.exif["Image Artist"].printable
             header.comments["OBSERVER"] = "Observer name"
 
-        # get version from __init__.py
-        with open(os.path.join(os.path.dirname(__file__), "__init__.py")) as f:
-            for line in f:
-                if line.startswith("__version__"):
-                    version = line.split("=")[1].strip().strip('"')
-                    header["SWCREATE"] = f"raw2fits v{version}"
-                    header.comments["SWCREATE"] = "Software used to create this file"
-                    break
-                
-        if path is None:
-            path = self.path.replace(self.file_extension, ".fits")
-        else:
-            path = os.path.join(path, self.path.split("/")[-1].replace(self.file_extension, ".fits"))
-
-        print(f"Saving FITS file to {path}")     
-        hdul.writeto(path, overwrite=True)
-        pass
-
+        return header
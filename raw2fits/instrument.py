@@ -0,0 +1,160 @@
+"""Instrumentation of the conversion stages.
+
+The stages report spans (e.g. "read", "unpack", "exif", "calibrate", "debayer", "header",
+"write") with their duration, bytes and pixels, and coarse progress events, one per
+block of rows. They are passed to the registered sinks, callables taking one event.
+No sink is registered by default, so the library is silent and the instrumentation
+costs next to nothing unless it is used. The sinks below print the events, log them,
+append them to a JSON lines file or keep them in memory:
+
+    from raw2fits import instrument
+    recorder = instrument.Recorder()
+    with instrument.sinks(recorder):
+        Image(path).save_fits("LIGHT")
+    recorder.totals() # {"read": 0.05, "unpack": 0.61, ...}
+"""
+import contextlib
+import json
+import logging
+import sys
+import threading
+import time
+from collections import namedtuple
+
+
+Span = namedtuple("Span", ["stage", "path", "start", "seconds", "bytes", "pixels"])
+Span.__doc__ = """A completed stage: start is a time.time() timestamp, bytes and pixels are None where they do not apply."""
+
+Progress = namedtuple("Progress", ["stage", "path", "done", "total"])
+Progress.__doc__ = """Progress of a stage, in units of the stage (rows for "debayer", frames for "combine")."""
+
+_SINKS = [] # Registered sinks, called in order with every event
+_local = threading.local() # Path of the file the current thread is working on
+
+
+def add_sink(sink):
+    """Register a callable that receives every Span and Progress event."""
+    _SINKS.append(sink)
+
+def remove_sink(sink):
+    """Unregister a sink added with add_sink."""
+    _SINKS.remove(sink)
+
+@contextlib.contextmanager
+def sinks(*sinks):
+    """Register sinks for the duration of a with block."""
+    for sink in sinks:
+        add_sink(sink)
+    try:
+        yield
+    finally:
+        for sink in sinks:
+            remove_sink(sink)
+
+def enabled():
+    """Return True if any sink is registered, e.g. to skip work that only serves instrumentation."""
+    return bool(_SINKS)
+
+def _emit(event):
+    for sink in list(_SINKS):
+        sink(event)
+
+@contextlib.contextmanager
+def span(stage, path=None, bytes=None, pixels=None):
+    """Time a stage. Yields a dict in which the body may set "bytes" and "pixels".
+
+    path defaults to the path of the enclosing span, and is seen by the spans and
+    progress events inside this one.
+    """
+    counts = {"bytes": bytes, "pixels": pixels}
+    if not _SINKS:
+        yield counts
+        return
+    outer_path = getattr(_local, "path", None)
+    path = path if path is not None else outer_path
+    _local.path = path
+    start, clock = time.time(), time.perf_counter()
+    try:
+        yield counts
+    finally:
+        _local.path = outer_path
+        _emit(Span(stage, path, start, time.perf_counter() - clock, counts["bytes"], counts["pixels"]))
+
+def progress(stage, done, total):
+    """Report that done of total units of a stage are complete."""
+    if _SINKS:
+        _emit(Progress(stage, getattr(_local, "path", None), done, total))
+
+
+class PrintSink():
+    """Sink printing spans as they complete, and the progress of a stage on a single updating line.
+    file defaults to sys.stdout. Events from several threads are printed one at a time."""
+    def __init__(self, file=None):
+        self.file = file
+        self._progress_line = False # A progress line without its newline has been printed
+        self._lock = threading.Lock()
+
+    def __getstate__(self): # Sinks are pickled to the batch worker processes, which get a lock of their own
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        file = self.file or sys.stdout
+        with self._lock:
+            if isinstance(event, Progress):
+                self._progress_line = event.done < event.total
+                print(f"\r{event.stage} {event.done}/{event.total}", end="" if self._progress_line else "\n", file=file, flush=True)
+                return
+            if self._progress_line: # Finish the progress line of an interrupted stage
+                print(file=file)
+                self._progress_line = False
+            details = "".join([f", {event.bytes/1e6:.1f} MB" if event.bytes is not None else "",
+                               f", {event.pixels/1e6:.1f} MP" if event.pixels is not None else ""])
+            print(f"{event.stage} {event.path or ''} {event.seconds:.3f} s{details}", file=file)
+
+class LoggingSink():
+    """Sink writing spans to a logging.Logger (progress at DEBUG level), with the event fields in `extra`."""
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger("raw2fits")
+        self.level = level
+
+    def __call__(self, event):
+        if isinstance(event, Progress):
+            self.logger.debug("%s %s %d/%d", event.stage, event.path, event.done, event.total, extra=event._asdict())
+        else:
+            self.logger.log(self.level, "%s %s %.3f s", event.stage, event.path, event.seconds, extra=event._asdict())
+
+class JSONLinesSink():
+    """Sink appending spans (and progress, if progress=True) to a file as JSON lines, e.g. for a metrics system.
+    Several threads and processes may append to the same file."""
+    def __init__(self, path, progress=False):
+        self.path = path
+        self.progress = progress
+
+    def __call__(self, event):
+        if isinstance(event, Progress) and not self.progress:
+            return
+        line = json.dumps({"event": type(event).__name__.lower(), **event._asdict()}) + "\n"
+        with open(self.path, "a") as f: # One append per line, so lines from concurrent writers do not mix
+            f.write(line)
+
+class Recorder():
+    """Sink keeping the spans (and the progress events) in memory."""
+    def __init__(self):
+        self.spans = []
+        self.progress = []
+
+    def __call__(self, event):
+        (self.progress if isinstance(event, Progress) else self.spans).append(event)
+
+    def totals(self):
+        """Return the total seconds per stage."""
+        totals = {}
+        for event in self.spans:
+            totals[event.stage] = totals.get(event.stage, 0.0) + event.seconds
+        return totals
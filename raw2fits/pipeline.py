@@ -0,0 +1,195 @@
+"""Pipelined conversion of raw files to FITS.
+
+The conversion of a file has three stages: reading and unpacking the raw file,
+debayering, and writing the FITS file. Instead of running them one after another,
+each stage runs in its own thread(s) and hands frames to the next stage through a
+bounded queue, so the disk is busy while the CPU debayers and vice versa:
+
+    readers --(read queue)--> debayer --(write queue)--> writers
+
+The debayer stage runs the kernels on numba's thread pool (which releases the GIL),
+and a full queue blocks the stage that feeds it, which bounds the number of frames
+in memory to roughly readers + writers + 2*queue_depth + 1.
+"""
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from raw2fits.batch import BatchResult, is_up_to_date, output_path
+from raw2fits.calibration import load_calibration
+from raw2fits.image import Image
+
+
+StageStats = namedtuple("StageStats", ["name", "workers", "items", "busy", "blocked", "utilization"])
+StageStats.__doc__ = """Timing of one pipeline stage: busy is the time spent working and blocked the time spent waiting
+for the next stage to accept a frame (both summed over the stage's workers, in seconds). utilization is
+busy divided by the wall time available to the stage's workers."""
+
+
+class _Stage():
+    """Thread-safe busy/blocked time accounting for one pipeline stage."""
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, busy, blocked):
+        with self._lock:
+            self.items += 1
+            self.busy += busy
+            self.blocked += blocked
+
+    def stats(self, elapsed):
+        utilization = self.busy/(elapsed*self.workers) if elapsed > 0 else 0.0
+        return StageStats(self.name, self.workers, self.items, self.busy, self.blocked, utilization)
+
+def _put(q, item):
+    """Put item on a bounded queue, returning how long the caller was blocked by backpressure."""
+    start = time.perf_counter()
+    q.put(item)
+    return time.perf_counter() - start
+
+def convert_pipelined(paths, image_type="LIGHT", output_dir=None, debayer_method="VNG", n_threads=None,
+                      precision="float64", readers=2, writers=1, queue_depth=2, overwrite=False, callback=None, engine=None, calibration=None, compress=None, cache=None,
+                      binning=1, roi=None):
+    """Convert raw files to FITS with reading, debayering and writing overlapped.
+
+    Parameters
+    ----------
+    paths : list of str
+        Raw files to convert, see raw2fits.batch.find_raw_files.
+    image_type : str
+        "LIGHT", "DARK", "FLAT" or "BIAS", written to every output header.
+    output_dir : str, optional
+        Directory for the FITS files. If None, each file is written next to its raw file.
+    debayer_method : str
+        Debayering method, see raw2fits.debayer.debayer_array.
+    n_threads : int, optional
+        Size of the compute pool used by the debayer stage. Defaults to all available cores.
+    precision : str
+        Floating point precision of the VNG kernel, "float64" or "float32".
+    readers : int
+        Number of reader threads that prefetch and unpack raw files.
+    writers : int
+        Number of writer threads.
+    queue_depth : int
+        Capacity of the queues between the stages.
+    overwrite : bool
+        Convert files whose FITS output is already up to date.
+    callback : callable, optional
+        Called with each BatchResult as soon as it is available.
+    engine : str, optional
+        Preferred debayer implementation, see raw2fits.debayer.debayer_array.
+    calibration : Calibration or str, optional
+        Master frames applied to every frame in the read stage, see raw2fits.calibration.
+    compress : str, optional
+        Write tile-compressed FITS files with this algorithm, e.g. "RICE_1", see raw2fits.fitsio.
+    cache : DebayerCache or str, optional
+        Cache of debayered images, see raw2fits.cache.
+    binning : int
+        CFA binning factor applied before debayering, see raw2fits.image.Image.
+    roi : tuple of int, optional
+        (x, y, width, height) region of interest converted from every frame, see raw2fits.image.Image.
+
+    Returns
+    -------
+    results : list of BatchResult
+        One result per path, in completion order.
+    stats : list of StageStats
+        Utilization of the read, debayer and write stages.
+
+    """
+    if image_type not in ["LIGHT", "DARK", "FLAT", "BIAS"]:
+        raise ValueError(f"Invalid image type: {image_type}")
+    if min(readers, writers, queue_depth) < 1:
+        raise ValueError("readers, writers and queue_depth must be positive integers.")
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    results = []
+    results_lock = threading.Lock()
+    def finish(result):
+        with results_lock:
+            results.append(result)
+        if callback is not None:
+            callback(result)
+
+    path_queue = queue.Queue()
+    for path in paths:
+        if not overwrite and is_up_to_date(path, output_path(path, output_dir)):
+            finish(BatchResult(path, output_path(path, output_dir), 0.0, True, None))
+        else:
+            path_queue.put(path)
+    n_frames = path_queue.qsize()
+    calibration = load_calibration(calibration) # Loaded once, shared by the reader threads
+    read_queue = queue.Queue(maxsize=queue_depth)
+    write_queue = queue.Queue(maxsize=queue_depth)
+    read_stage, debayer_stage, write_stage = _Stage("read", readers), _Stage("debayer", 1), _Stage("write", writers)
+
+    # Every frame travels through the queues as (img, start time, error message)
+    def read():
+        while True:
+            try:
+                path = path_queue.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            error = None
+            try:
+                img = Image(path, debayer_method=debayer_method, n_threads=n_threads, precision=precision, engine=engine, calibration=calibration, cache=cache,
+                            binning=binning, roi=roi)
+                img.prefetch() # The mosaic, unless the debayered image is in the cache
+            except Exception as e:
+                img, error = path, f"{type(e).__name__}: {e}"
+            busy = time.perf_counter() - start
+            read_stage.record(busy, _put(read_queue, (img, start, error)))
+
+    def write():
+        while True:
+            item = write_queue.get()
+            if item is None:
+                return
+            img, start, error = item
+            path = img if error is not None else img.path
+            output = output_path(path, output_dir)
+            busy_start = time.perf_counter()
+            if error is None:
+                try:
+                    img.save_fits(image_type, path=output_dir, compress=compress)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                img.release() # Free the frame now rather than when the next one replaces it
+                write_stage.record(time.perf_counter() - busy_start, 0.0)
+            finish(BatchResult(path, output, time.perf_counter() - start, False, error))
+
+    pipeline_start = time.perf_counter()
+    threads = [threading.Thread(target=read, daemon=True) for _ in range(readers)]
+    threads += [threading.Thread(target=write, daemon=True) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+
+    # The debayer stage runs in the calling thread; the kernels use numba's thread pool
+    for _ in range(n_frames):
+        img, start, error = read_queue.get()
+        if error is None:
+            busy_start = time.perf_counter()
+            try:
+                img.debayer()
+            except Exception as e:
+                img, error = img.path, f"{type(e).__name__}: {e}"
+            busy = time.perf_counter() - busy_start
+            debayer_stage.record(busy, _put(write_queue, (img, start, error)))
+        else:
+            write_queue.put((img, start, error))
+    for _ in range(writers):
+        write_queue.put(None) # Tell the writers to stop
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - pipeline_start
+    return results, [stage.stats(elapsed) for stage in (read_stage, debayer_stage, write_stage)]
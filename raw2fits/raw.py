@@ -0,0 +1,88 @@
+import io
+import os
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+
+from raw2fits import instrument
+from raw2fits.debayer import raw_bayer_pattern
+
+
+RawFrame = namedtuple("RawFrame", ["bayer_image", "bayer_pattern", "exif"])
+RawFrame.__doc__ = """Everything raw2fits needs from a raw file: the visible Bayer mosaic, its Bayer pattern and the EXIF tags."""
+
+
+def read_file(path):
+    """Read the contents of a raw file, reported as the "read" span of `raw2fits.instrument`."""
+    with instrument.span("read", path) as counts:
+        with open(path, "rb") as f:
+            buffer = f.read()
+        counts["bytes"] = len(buffer)
+    return buffer
+
+def read_raw(path, buffer=None):
+    """Read a raw file in a single pass.
+
+    The file is read into memory once; LibRaw decodes the mosaic from that buffer and
+    exifread parses the EXIF tags from the same buffer, so the file is opened only once.
+    The three steps are reported as the "read", "unpack" and "exif" spans of `raw2fits.instrument`.
+
+    Parameters
+    ----------
+    path : str
+        Path to the raw image.
+    buffer : bytes, optional
+        Contents of the file, if they have already been read with read_file.
+
+    Returns
+    -------
+    frame : RawFrame
+        The visible Bayer mosaic (uint16), its Bayer pattern (e.g. "RGGB") and the EXIF tags.
+
+    """
+    # Check file existence
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"File {path} does not exist.")
+
+    import exifread, rawpy # Imported on use, so that importing raw2fits stays fast
+
+    if buffer is None:
+        buffer = read_file(path)
+
+    with instrument.span("unpack", path) as counts:
+        with rawpy.imread(io.BytesIO(buffer)) as raw:
+            bayer_image = np.array(raw.raw_image_visible) # Copy, LibRaw frees its buffers when the handle is closed
+            bayer_pattern = raw_bayer_pattern(raw)
+        counts["bytes"], counts["pixels"] = bayer_image.nbytes, bayer_image.size
+    with instrument.span("exif", path):
+        exif = exifread.process_file(io.BytesIO(buffer), details=False, extract_thumbnail=False) # Skip the maker notes and thumbnail
+    return RawFrame(bayer_image=bayer_image, bayer_pattern=bayer_pattern, exif=exif)
+
+def read_exif(path, buffer=None):
+    """Read only the EXIF tags of a raw file, or of buffer, its contents, without decoding the image. See read_raw."""
+    import exifread
+
+    if buffer is not None:
+        with instrument.span("exif", path):
+            return exifread.process_file(io.BytesIO(buffer), details=False, extract_thumbnail=False)
+    with instrument.span("exif", path), open(path, "rb") as f:
+        return exifread.process_file(f, details=False, extract_thumbnail=False)
+
+def observation_dates(exif):
+    """Return the (local, UTC) date of the exposure in ISO format, from the EXIF DateTime and OffsetTime tags.
+    Without a time zone offset the UTC date is unknown and None; without a DateTime both are None."""
+    if "Image DateTime" not in exif:
+        return None, None
+    dt_str = exif["Image DateTime"].printable
+    if "EXIF OffsetTime" not in exif:
+        return datetime.strptime(dt_str, "%Y:%m:%d %H:%M:%S").isoformat(), None
+    dt = datetime.strptime(dt_str + exif["EXIF OffsetTime"].printable, "%Y:%m:%d %H:%M:%S%z")
+    return dt.replace(tzinfo=None).isoformat(), dt.astimezone(timezone.utc).replace(tzinfo=None).isoformat()
+
+def raw_image_size(path):
+    """Return the (height, width) of the visible Bayer mosaic of a raw file, without decoding it."""
+    import rawpy
+
+    with rawpy.imread(path) as raw: # LibRaw only parses the metadata until the image is accessed
+        return (raw.sizes.height, raw.sizes.width)
@@ -0,0 +1,171 @@
+"""Stacking (integration) of debayered frames.
+
+Combines any number of (3, height, width) frames without holding them in memory: FITS
+files are memory-mapped as they are on disk, and raw files are debayered strip by strip
+into temporary memory maps. The frames are then combined a block of rows at a time by a
+pool of threads, so the memory used is set by the block size, not by the number of frames.
+
+    raw2fits-stack fits/lights/ -m sigma_clip -o stacked.fits
+"""
+import argparse
+import contextlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from raw2fits import instrument
+from raw2fits.batch import RAW_EXTENSIONS, find_raw_files
+from raw2fits.combine import _CHUNK_BYTES, COMBINE_METHODS, combine_chunk
+from raw2fits.debayer import _PRECISIONS, debayer_array, output_shape
+
+
+FITS_EXTENSIONS = (".fits", ".fit", ".fts")
+
+
+def find_frames(inputs):
+    """Expand files, directories and glob patterns into a sorted list of FITS and raw files."""
+    return find_raw_files(inputs, extensions=FITS_EXTENSIONS + RAW_EXTENSIONS)
+
+def _open_fits(path, stack):
+    """Memory-map the image of a FITS file (tile-compressed images are decompressed in memory).
+    Returns (data, scale, zero), where the stored values are converted to physical ones as data*scale + zero."""
+    from astropy.io import fits
+
+    # Keep the stored integers: astropy would otherwise apply BZERO to the whole image at once
+    hdul = stack.enter_context(fits.open(path, memmap=True, do_not_scale_image_data=True))
+    hdu = hdul[1] if hdul[0].header["NAXIS"] == 0 and len(hdul) > 1 else hdul[0] # Tile-compressed files keep the image in an extension
+    return hdu.data, hdu.header.get("BSCALE", 1.0), hdu.header.get("BZERO", 0.0)
+
+def _open_raw(path, tmpdir, index, debayer_method, engine, n_threads, calibration):
+    """Debayer a raw file into a memory map in tmpdir, strip by strip. Returns (data, 1, 0)."""
+    from raw2fits.image import Image
+
+    img = Image(path, debayer_method=debayer_method, engine=engine, n_threads=n_threads, calibration=calibration)
+    img.read()
+    data = np.lib.format.open_memmap(os.path.join(tmpdir, f"frame{index}.npy"), mode="w+", dtype=np.uint16,
+                                     shape=output_shape(img.image_size, debayer_method))
+    debayer_array(img.bayer_image, img.bayer_pattern, method=debayer_method, engine=engine, n_threads=n_threads, out=data)
+    data.flush()
+    return data, 1.0, 0.0
+
+def stack_frames(paths, method="sigma_clip", sigma=3.0, iterations=5, precision="float64", workers=None, chunk_rows=None,
+                 out=None, debayer_method="VNG", engine=None, n_threads=None, calibration=None, workdir=None):
+    """Combine frames pixel by pixel into one image.
+
+    Parameters
+    ----------
+    paths : list of str
+        FITS files (e.g. written by Image.save_fits) and/or raw files, all of the same shape.
+    method : str
+        "mean", "median" or "sigma_clip", see raw2fits.combine.combine.
+    sigma : float
+        Clipping threshold of "sigma_clip", in standard deviations.
+    iterations : int
+        Maximum number of clipping iterations of "sigma_clip".
+    precision : str
+        Floating point precision of the combination, "float64" or "float32". float32 halves
+        the memory of each block of rows.
+    workers : int, optional
+        Number of threads combining blocks of rows in parallel. Defaults to the number of CPUs.
+    chunk_rows : int, optional
+        Rows per block. Defaults to a block of about 64 MB across all frames.
+    out : ndarray, optional
+        float32 array to write the result to, e.g. a np.memmap.
+    debayer_method, engine, n_threads, calibration
+        Used to debayer raw files, see raw2fits.image.Image.
+    workdir : str, optional
+        Directory for the debayered raw files. Defaults to the system temporary directory.
+
+    Returns
+    -------
+    stacked : ndarray
+        The combined image, float32.
+
+    """
+    if method not in COMBINE_METHODS:
+        raise ValueError(f"Invalid method {method}. Must be one of {', '.join(COMBINE_METHODS)}.")
+    if precision not in _PRECISIONS:
+        raise ValueError(f"Invalid precision {precision}. Must be one of {', '.join(_PRECISIONS)}.")
+    if not paths:
+        raise ValueError("No frames to stack.")
+    dtype = _PRECISIONS[precision]
+
+    with contextlib.ExitStack() as stack:
+        tmpdir = None
+        frames = [] # (data, scale, zero) per frame
+        for index, path in enumerate(paths):
+            if os.path.splitext(path)[1].lower() in FITS_EXTENSIONS:
+                frames.append(_open_fits(path, stack))
+            else:
+                tmpdir = tmpdir or stack.enter_context(tempfile.TemporaryDirectory(dir=workdir))
+                frames.append(_open_raw(path, tmpdir, index, debayer_method, engine, n_threads, calibration))
+            if frames[-1][0].shape != frames[0][0].shape:
+                raise ValueError(f"{path} has shape {frames[-1][0].shape}, but {paths[0]} has shape {frames[0][0].shape}.")
+        shape = frames[0][0].shape
+        if out is None:
+            out = np.empty(shape, dtype=np.float32)
+
+        row_bytes = len(frames)*int(np.prod(shape))//shape[-2]*np.dtype(dtype).itemsize # One row of every frame
+        chunk_rows = chunk_rows or max(1, _CHUNK_BYTES // row_bytes) # Memory budget per worker
+
+        def combine_rows(row_start):
+            rows = (Ellipsis, slice(row_start, min(row_start + chunk_rows, shape[-2])), slice(None))
+            chunk = np.empty((len(frames), *out[rows].shape), dtype=dtype)
+            for index, (data, scale, zero) in enumerate(frames):
+                chunk[index] = data[rows] # Reads the rows from disk and converts them to float
+                if scale != 1:
+                    chunk[index] *= scale
+                if zero:
+                    chunk[index] += zero
+            out[rows] = combine_chunk(chunk, method, sigma, iterations)
+            return rows[-2].stop
+
+        with instrument.span("stack", pixels=out.size, bytes=len(frames)*out.size*np.dtype(dtype).itemsize), \
+                ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor: # numpy releases the GIL while combining
+            for row_stop in executor.map(combine_rows, range(0, shape[-2], chunk_rows)):
+                instrument.progress("stack", row_stop, shape[-2])
+        return out
+
+def save_stack(path, stacked, n_frames, method, template=None, overwrite=True):
+    """Write a stacked image to a float32 FITS file, with the header of the FITS file template if given."""
+    from astropy.io import fits
+
+    header = fits.getheader(template) if template is not None else fits.Header()
+    for keyword in ("BSCALE", "BZERO"): # The data is float, not offset integers
+        header.remove(keyword, ignore_missing=True)
+    hdu = fits.PrimaryHDU(stacked, header=header)
+    hdu.header["NCOMBINE"] = (n_frames, "Number of frames combined")
+    hdu.header["COMBMETH"] = (method, "Combination method")
+    hdu.writeto(path, overwrite=overwrite)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="raw2fits-stack", description="Stack FITS or raw frames into one image.")
+    parser.add_argument("inputs", nargs="+", help="FITS or raw files, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="FITS file to write the stacked image to")
+    parser.add_argument("-m", "--method", default="sigma_clip", choices=COMBINE_METHODS, help="combination method (default: sigma_clip)")
+    parser.add_argument("--sigma", type=float, default=3.0, help="clipping threshold of sigma_clip (default: 3)")
+    parser.add_argument("--precision", default="float64", choices=list(_PRECISIONS), help="precision of the combination (default: float64)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="threads combining blocks of rows (default: number of CPUs)")
+    parser.add_argument("--chunk-rows", type=int, default=None, help="rows per block (default: about 64 MB per block)")
+    parser.add_argument("--debayer-method", default="VNG", help="debayering method for raw inputs (default: VNG)")
+    parser.add_argument("--calibration", default=None, help="master frames to calibrate raw inputs with, see raw2fits-calibrate")
+    parser.add_argument("--workdir", default=None, help="directory for debayered raw inputs (default: system temp)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the progress and the time of every stage")
+    args = parser.parse_args(argv)
+
+    paths = find_frames(args.inputs)
+    print(f"Found {len(paths)} frames")
+    with instrument.sinks(*([instrument.PrintSink()] if args.verbose else [])):
+        stacked = stack_frames(paths, method=args.method, sigma=args.sigma, precision=args.precision, workers=args.workers,
+                               chunk_rows=args.chunk_rows, debayer_method=args.debayer_method, calibration=args.calibration, workdir=args.workdir)
+    fits_inputs = [path for path in paths if os.path.splitext(path)[1].lower() in FITS_EXTENSIONS]
+    save_stack(args.output, stacked, len(paths), args.method, template=fits_inputs[0] if fits_inputs else None)
+    print(f"Saved {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -20,6 +20,14 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/jamiechang917/raw2fits",
     packages=setuptools.find_packages(),
+    entry_points={
+        "console_scripts": [
+            "raw2fits = raw2fits.batch:main",
+            "raw2fits-calibrate = raw2fits.calibration:main",
+            "raw2fits-stack = raw2fits.stack:main",
+            "raw2fits-catalog = raw2fits.catalog:main",
+        ],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -28,16 +36,13 @@ setuptools.setup(
         "Intended Audience :: Science/Research",
         "Topic :: Scientific/Engineering :: Astronomy",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     license="MIT",
     install_requires=[
         "numpy",
         "astropy",
         "rawpy",
         "numba",
-        "tqdm",
-        "matplotlib",
-        "numba_progress",
         "exifread",
         "opencv-python"
     ]
@@ -1,9 +1,5 @@
-import matplotlib.pyplot as plt
-import numpy as np
-from astropy.io import fits
-from pprint import pprint
-from image import *
-import exifread
+import os
+from raw2fits.image import Image
 
 path = "tests/img/test.CR2"
 
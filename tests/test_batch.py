@@ -0,0 +1,47 @@
+"""Discovery of raw files and output paths of batch conversions."""
+import os
+
+import pytest
+
+from raw2fits.batch import convert_file, find_raw_files, is_up_to_date, output_path
+
+
+@pytest.fixture
+def directory(tmp_path):
+    for name in ("b.CR2", "a.nef", "c.dng", "notes.txt", "image.fits"):
+        (tmp_path / name).write_bytes(b"")
+    (tmp_path / "sub.dng").mkdir() # Not a file
+    return tmp_path
+
+def test_find_raw_files_in_directory(directory):
+    names = ["a.nef", "b.CR2", "c.dng"] # Sorted, other extensions and directories skipped, extensions in any case
+    assert find_raw_files([str(directory)]) == [str(directory / name) for name in names]
+
+def test_find_raw_files_glob_and_files(directory):
+    assert find_raw_files([str(directory / "*.dng"), str(directory / "c.dng")]) == [str(directory / "c.dng")] # No duplicates
+    assert find_raw_files([str(directory / "notes.txt")]) == []
+    assert find_raw_files([str(directory / "a.*")], extensions=(".nef",)) == [str(directory / "a.nef")]
+
+def test_find_raw_files_missing_path(directory):
+    with pytest.raises(FileNotFoundError):
+        find_raw_files([str(directory), str(directory / "missing.dng")])
+    with pytest.raises(FileNotFoundError):
+        find_raw_files([str(directory / "*.cr3")]) # A pattern that matches nothing
+
+def test_output_path():
+    assert output_path("raw/frame.CR2") == "raw/frame.fits"
+    assert output_path("raw/frame.CR2", "fits/lights") == os.path.join("fits/lights", "frame.fits")
+
+def test_is_up_to_date(directory):
+    raw, output = str(directory / "c.dng"), str(directory / "c.fits")
+    assert not is_up_to_date(raw, output)
+    (directory / "c.fits").write_bytes(b"")
+    os.utime(raw, (1000, 1000))
+    assert is_up_to_date(raw, output)
+    os.utime(output, (500, 500)) # The raw file changed after the conversion
+    assert not is_up_to_date(raw, output)
+
+def test_convert_file_reports_error(tmp_path):
+    result = convert_file(str(tmp_path / "missing.dng"), output_dir=str(tmp_path))
+    assert result.error.startswith("FileNotFoundError")
+    assert result.output == str(tmp_path / "missing.fits") and not result.skipped
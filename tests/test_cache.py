@@ -0,0 +1,109 @@
+"""Content-addressed cache of debayered images, and its use by the lazy Image."""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from raw2fits import debayer, image
+from raw2fits.cache import DebayerCache, buffer_digest, file_digest
+from raw2fits.raw import RawFrame
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DebayerCache(str(tmp_path / "cache"))
+
+def test_buffer_digest_equals_file_digest(tmp_path):
+    contents = np.random.default_rng(0).bytes(3*(1 << 20) + 17) # Several chunks of file_digest
+    path = tmp_path / "frame.dng"
+    path.write_bytes(contents)
+    assert buffer_digest(contents) == file_digest(str(path))
+    assert file_digest(str(path), chunk_size=1000) == file_digest(str(path))
+    assert buffer_digest(contents[:-1]) != file_digest(str(path))
+
+
+KEY_ARGUMENTS = dict(digest="0123", method="VNG", engine="numba", precision="float64", calibration=None, binning=1, roi=None)
+
+@pytest.mark.parametrize("field, value", [
+    ("digest", "4567"),
+    ("method", "Bilinear"),
+    ("engine", "numpy"),
+    ("precision", "float32"),
+    ("calibration", SimpleNamespace(digest="89ab")),
+    ("binning", 2),
+    ("roi", (0, 0, 64, 64)),
+])
+def test_key_depends_on_settings(cache, field, value):
+    assert cache.key(**{**KEY_ARGUMENTS, field: value}) != cache.key(**KEY_ARGUMENTS)
+
+def test_key_of_full_frames(cache):
+    assert cache.key(**KEY_ARGUMENTS) == cache.key("0123", "VNG", "numba", "float64")
+    assert cache.key(**KEY_ARGUMENTS) == DebayerCache(cache.directory).key(**KEY_ARGUMENTS)
+    calibrated = {**KEY_ARGUMENTS, "calibration": SimpleNamespace(digest="89ab")}
+    assert cache.key(**calibrated) == cache.key(**{**calibrated, "calibration": SimpleNamespace(digest="89ab")})
+
+def test_key_depends_on_engine_version(cache, monkeypatch):
+    key = cache.key(**KEY_ARGUMENTS)
+    monkeypatch.setitem(debayer._VERSIONS, ("VNG", "numba"), "2")
+    assert cache.key(**KEY_ARGUMENTS) != key
+
+def test_store_and_load(cache):
+    stored = np.random.default_rng(0).integers(0, 65536, size=(3, 10, 12), dtype=np.uint16)
+    key = cache.key(**KEY_ARGUMENTS)
+    assert key not in cache
+    assert cache.load(key) is None
+    cache.store(key, stored)
+    assert key in cache
+    loaded = cache.load(key)
+    assert loaded.dtype == np.uint16
+    assert np.array_equal(loaded, stored)
+    cache.clear()
+    assert cache.load(key) is None
+
+
+@pytest.fixture
+def raw_file(tmp_path, monkeypatch):
+    """A raw file, decoded by a stand-in for rawpy, and a count of the calls to debayer_array by Image."""
+    mosaic = np.random.default_rng(1).integers(0, 16384, size=(20, 24), dtype=np.uint16)
+    path = tmp_path / "frame.dng"
+    path.write_bytes(mosaic.tobytes())
+    monkeypatch.setattr(image, "read_raw", lambda path, buffer=None: RawFrame(mosaic.copy(), "RGGB", {}))
+    monkeypatch.setattr(image, "read_exif", lambda path, buffer=None: {})
+    calls = []
+    debayer_array = image.debayer_array
+    def counting_debayer_array(*args, **kwargs):
+        calls.append(args)
+        return debayer_array(*args, **kwargs)
+    monkeypatch.setattr(image, "debayer_array", counting_debayer_array)
+    return SimpleNamespace(path=str(path), mosaic=mosaic, calls=calls)
+
+def test_image_is_debayered_once_with_cache(raw_file, cache):
+    first = image.Image(raw_file.path, cache=cache).debayer_image
+    assert len(raw_file.calls) == 1
+    second = image.Image(raw_file.path, cache=cache.directory).debayer_image
+    assert len(raw_file.calls) == 1 # Loaded from the cache
+    assert np.array_equal(second, first)
+    assert np.array_equal(first, debayer.debayer_array(raw_file.mosaic, "RGGB"))
+
+def test_image_with_other_settings_misses_cache(raw_file, cache):
+    image.Image(raw_file.path, cache=cache).debayer_image
+    image.Image(raw_file.path, cache=cache, binning=2).debayer_image
+    image.Image(raw_file.path, cache=cache, engine="numpy").debayer_image
+    assert len(raw_file.calls) == 3
+    image.Image(raw_file.path, cache=cache, binning=2).debayer_image
+    assert len(raw_file.calls) == 3
+
+def test_image_is_lazy(raw_file):
+    img = image.Image(raw_file.path)
+    assert img._bayer_image is None and img._debayer_image is None
+    assert img.debayer_image.shape == (3, 20, 24)
+    img.release()
+    assert img._debayer_image is None
+    img.debayer_image
+    assert len(raw_file.calls) == 2
+
+@pytest.mark.parametrize("settings", [dict(debayer_method="vng"), dict(engine="cuda"), dict(precision="float16"),
+                                      dict(binning=0), dict(binning=1.5)])
+def test_image_rejects_invalid_settings(raw_file, settings):
+    with pytest.raises(ValueError):
+        image.Image(raw_file.path, **settings)
@@ -0,0 +1,59 @@
+"""Metadata scan and incremental catalog of raw files, on synthetic DNG files."""
+import os
+
+import numpy as np
+import pytest
+
+from raw2fits.catalog import Catalog, scan_file
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """A directory of three synthetic DNG files, see benchmarks/synthetic.py."""
+    pytest.importorskip("pidng")
+    from benchmarks.synthetic import write_dng
+
+    mosaic = np.zeros((16, 24), dtype=np.uint16)
+    return [write_dng(str(tmp_path / f"frame{index}"), mosaic) for index in range(3)]
+
+def test_scan_file(archive):
+    info = scan_file(archive[0])
+    assert info.error is None
+    assert info.size == os.path.getsize(archive[0])
+    assert (info.exposure_time, info.iso, info.focal_length, info.model) == (30.0, 800, 135.0, "Synthetic")
+    assert info.date_loc == info.date_obs == "2024-01-02T03:04:05" # No time zone in the EXIF
+
+def test_scan_missing_file(tmp_path):
+    info = scan_file(str(tmp_path / "deleted.dng"))
+    assert info.error.startswith("FileNotFoundError")
+    assert info.mtime is None and info.exposure_time is None
+
+def test_scan_file_without_exif(tmp_path):
+    path = tmp_path / "broken.dng"
+    path.write_bytes(b"not a raw file")
+    info = scan_file(str(path))
+    assert info.size == 14
+    assert info[3:-1] == (None,)*7
+
+def test_update_scans_only_changed_files(archive, tmp_path):
+    with Catalog(":memory:") as catalog:
+        assert catalog.update([str(tmp_path)]) == (3, 0, 0)
+        assert len(catalog) == 3
+        assert catalog.update([str(tmp_path)]) == (0, 3, 0) # Nothing changed, nothing scanned
+        os.utime(archive[1], (0, 0))
+        assert catalog.update([str(tmp_path)]) == (1, 2, 0)
+        assert catalog.groups() == {("Synthetic", 800, 30.0): sorted(os.path.abspath(path) for path in archive)}
+
+def test_update_prunes_deleted_files(archive, tmp_path):
+    with Catalog(":memory:") as catalog:
+        catalog.update([str(tmp_path)])
+        os.remove(archive[0])
+        assert catalog.update([str(tmp_path)], prune=False) == (0, 2, 0)
+        assert len(catalog) == 3
+        assert catalog.update([str(tmp_path)]) == (0, 2, 1)
+        assert [info.path for info in catalog.frames()] == [os.path.abspath(path) for path in archive[1:]]
+
+def test_frames_rejects_invalid_column():
+    with Catalog(":memory:") as catalog:
+        with pytest.raises(ValueError):
+            catalog.frames(camera="EOS 6D")
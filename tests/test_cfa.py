@@ -0,0 +1,85 @@
+"""Region of interest and binning of Bayer mosaics."""
+import numpy as np
+import pytest
+
+from raw2fits.cfa import BAYER_PATTERNS, bin_cfa, binned_shape, crop_cfa, roi_origin, snap_roi
+
+
+def color_mosaic(bayer_pattern, shape):
+    """Mosaic whose value encodes the color of each site: 1000 red, 2000 green, 3000 blue."""
+    values = {"R": 1000, "G": 2000, "B": 3000}
+    tile = np.array([values[color] for color in bayer_pattern], dtype=np.uint16).reshape(2, 2)
+    return np.tile(tile, (shape[0] // 2 + 1, shape[1] // 2 + 1))[:shape[0], :shape[1]]
+
+
+@pytest.mark.parametrize("roi, expected", [
+    ((4, 6, 10, 8), (slice(6, 14), slice(4, 14))), # Even offsets and sizes are kept
+    ((5, 7, 10, 8), (slice(6, 16), slice(4, 16))), # Odd offsets are rounded down, the ends up
+    ((3, 1, 3, 3), (slice(0, 4), slice(2, 6))),
+    ((15, 17, 100, 100), (slice(16, 31), slice(14, 41))), # Clipped to the mosaic, which may leave an odd size
+])
+def test_snap_roi(roi, expected):
+    assert snap_roi((31, 41), roi) == expected
+    assert roi_origin(roi) == (expected[0].start, expected[1].start)
+
+@pytest.mark.parametrize("roi", [(-1, 0, 4, 4), (0, 0, 0, 4), (0, 0, 4, 0), (41, 0, 4, 4), (0, 31, 4, 4)])
+def test_snap_roi_rejects_invalid_regions(roi):
+    with pytest.raises(ValueError):
+        snap_roi((31, 41), roi)
+
+@pytest.mark.parametrize("bayer_pattern", BAYER_PATTERNS)
+def test_crop_keeps_pattern(bayer_pattern):
+    mosaic = color_mosaic(bayer_pattern, (32, 40))
+    cropped = crop_cfa(mosaic, (3, 5, 9, 7))
+    assert np.array_equal(cropped, color_mosaic(bayer_pattern, cropped.shape))
+
+
+@pytest.mark.parametrize("shape, factor, expected", [
+    ((32, 48), 1, (32, 48)),
+    ((33, 49), 1, (33, 49)),
+    ((32, 48), 2, (16, 24)),
+    ((32, 48), 3, (10, 16)), # Incomplete 6x6 blocks at the bottom are dropped
+    ((37, 50), 3, (12, 16)),
+])
+def test_binned_shape(shape, factor, expected):
+    assert binned_shape(shape, factor) == expected
+    assert bin_cfa(np.zeros(shape, dtype=np.uint16), factor).shape == expected
+
+@pytest.mark.parametrize("bayer_pattern", BAYER_PATTERNS)
+@pytest.mark.parametrize("factor", [2, 3])
+def test_bin_keeps_pattern(bayer_pattern, factor):
+    mosaic = color_mosaic(bayer_pattern, (37, 50))
+    binned = bin_cfa(mosaic, factor)
+    assert np.array_equal(binned, color_mosaic(bayer_pattern, binned.shape))
+
+def test_bin_factor_3_averages_same_color_sites():
+    mosaic = np.random.default_rng(0).integers(0, 65536, size=(13, 14), dtype=np.uint16)
+    binned = bin_cfa(mosaic, 3)
+    assert binned.shape == (4, 4)
+    for y in range(4):
+        for x in range(4):
+            # Output site (y, x) averages the 3x3 sites of its color in block (y // 2, x // 2) of 6x6 pixels
+            rows = 6*(y // 2) + y % 2 + np.arange(0, 6, 2)
+            cols = 6*(x // 2) + x % 2 + np.arange(0, 6, 2)
+            assert binned[y, x] == np.round(mosaic[np.ix_(rows, cols)].mean())
+
+def test_bin_float_mosaic():
+    mosaic = np.arange(8*8, dtype=np.float32).reshape(8, 8)
+    assert bin_cfa(mosaic, 2)[0, 0] == np.mean(mosaic[[0, 0, 2, 2], [0, 2, 0, 2]])
+
+@pytest.mark.parametrize("factor", [0, -1, 1.5])
+def test_bin_rejects_invalid_factor(factor):
+    with pytest.raises(ValueError):
+        bin_cfa(np.zeros((8, 8), dtype=np.uint16), factor)
+
+
+@pytest.mark.parametrize("binning, roi", [(1, (5, 3, 20, 14)), (2, None), (3, (2, 4, 30, 24))])
+def test_debayer_file_with_binning_and_roi(tmp_path, binning, roi):
+    pytest.importorskip("pidng")
+    from benchmarks.synthetic import write_dng
+    from raw2fits.debayer import debayer, debayer_array
+
+    mosaic = np.random.default_rng(2).integers(0, 16384, size=(32, 48), dtype=np.uint16)
+    path = write_dng(str(tmp_path / "frame"), mosaic, "GRBG")
+    expected = debayer_array(bin_cfa(crop_cfa(mosaic, roi) if roi else mosaic, binning), "GRBG", method="Bilinear")
+    assert np.array_equal(debayer(path, method="Bilinear", binning=binning, roi=roi), expected)
@@ -0,0 +1,71 @@
+"""Combination of frame stacks and flat normalization on small synthetic stacks."""
+import numpy as np
+import pytest
+
+from raw2fits.calibration import normalize_flat
+from raw2fits.combine import combine, combine_chunk
+
+
+def noisy_stack(n_frames=15, shape=(6, 8), level=1000.0, noise=5.0, seed=0):
+    rng = np.random.default_rng(seed)
+    return (level + rng.normal(0, noise, size=(n_frames, *shape))).astype(np.float32)
+
+
+def test_sigma_clip_rejects_outlier():
+    stack = noisy_stack()
+    clean_mean = stack.mean(axis=0)
+    stack[3, 2, 5] = 60000.0 # e.g. a cosmic ray or satellite trail in one frame
+    expected = np.delete(stack[:, 2, 5], 3).mean()
+    result = combine_chunk(stack.copy(), "sigma_clip", sigma=3.0, iterations=5)
+    assert result[2, 5] == pytest.approx(expected, rel=1e-6)
+    assert abs(result[2, 5] - 1000.0) < 10.0
+    assert abs(stack.mean(axis=0)[2, 5] - 1000.0) > 1000.0 # The plain mean is ruined by the outlier
+    others = np.ones(result.shape, dtype=bool)
+    others[2, 5] = False
+    assert np.allclose(result[others], clean_mean[others], rtol=1e-3) # Noise within 3 sigma is kept
+
+def test_sigma_clip_marks_rejected_values():
+    stack = noisy_stack()
+    stack[0, 0, 0] = -50000.0
+    chunk = stack.copy()
+    combine_chunk(chunk, "sigma_clip")
+    assert np.isnan(chunk[0, 0, 0])
+
+@pytest.mark.parametrize("method", ["mean", "median", "sigma_clip"])
+def test_combine_in_chunks_matches_combine_chunk(method):
+    stack = noisy_stack(shape=(21, 8)).astype(np.uint16)
+    expected = combine_chunk(stack.astype(np.float32), method)
+    assert np.allclose(combine(stack, method, chunk_rows=4), expected)
+
+def test_combine_does_not_modify_float32_stack():
+    stack = noisy_stack()
+    stack[3, 2, 5] = 60000.0
+    original = stack.copy()
+    combine(stack, "sigma_clip")
+    assert np.array_equal(stack, original)
+
+
+def test_normalize_flat_per_bayer_site():
+    rng = np.random.default_rng(1)
+    levels = np.array([[20000.0, 30000.0], [31000.0, 12000.0]], dtype=np.float32) # R, G, G, B response
+    flat = np.tile(levels, (16, 20)) * rng.uniform(0.9, 1.1, size=(32, 40)).astype(np.float32)
+    normalize_flat(flat)
+    for y in range(2):
+        for x in range(2):
+            assert np.median(flat[y::2, x::2]) == pytest.approx(1.0, rel=1e-6)
+
+def test_normalize_flat_sets_dead_pixels_to_one():
+    flat = np.full((8, 8), 5000.0, dtype=np.float32)
+    flat[3, 3] = 0.0
+    normalize_flat(flat)
+    assert flat[3, 3] == 1.0
+
+def test_normalize_flat_with_unexposed_site():
+    flat = np.full((8, 8), 5000.0, dtype=np.float32)
+    flat[1::2, 0::2] = 2500.0
+    flat[1::2, 1::2] = 0.0 # e.g. a channel the light source does not reach
+    flat[0, 2] = np.inf
+    flat[3, 0] = np.nan
+    normalize_flat(flat)
+    assert np.all(np.isfinite(flat))
+    assert np.all(flat == 1.0) # Normalized despite the infinite and NaN values, and the unexposed site left uncorrected
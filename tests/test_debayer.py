@@ -0,0 +1,83 @@
+"""Regression tests of the VNG kernel on the four CFA phases.
+
+tests/data/vng_rggb_reference.npz holds a random 14-bit RGGB mosaic and its debayered
+image as computed by the original, single-threaded VNG kernel of raw2fits 1.0.
+"""
+import os
+
+import numpy as np
+import pytest
+
+from raw2fits.cfa import BAYER_PATTERNS
+from raw2fits.debayer import debayer_array
+
+
+REFERENCE = os.path.join(os.path.dirname(__file__), "data", "vng_rggb_reference.npz")
+
+
+def flip_pattern(bayer_pattern, axis):
+    """Bayer pattern of a mosaic flipped upside down (axis=0) or left to right (axis=1)."""
+    tile = np.array(list(bayer_pattern)).reshape(2, 2)
+    return "".join(np.flip(tile, axis).flatten())
+
+@pytest.fixture(scope="module")
+def reference():
+    with np.load(REFERENCE) as data:
+        return data["mosaic"], data["output"]
+
+def max_difference(a, b):
+    return np.abs(a.astype(np.int64) - b.astype(np.int64)).max()
+
+
+def test_rggb_matches_original_kernel(reference):
+    mosaic, output = reference
+    assert np.array_equal(debayer_array(mosaic, "RGGB", engine="numba"), output)
+
+@pytest.mark.parametrize("axes", [(0,), (1,), (0, 1)])
+def test_flipped_phases_match_original_kernel(reference, axes):
+    """A flipped RGGB mosaic is a GBRG, GRBG or BGGR mosaic, whose debayered image is the flipped reference."""
+    mosaic, output = reference
+    bayer_pattern = "RGGB"
+    for axis in axes:
+        bayer_pattern = flip_pattern(bayer_pattern, axis)
+    flipped = np.ascontiguousarray(np.flip(mosaic, axes))
+    expected = np.flip(output, [axis + 1 for axis in axes])
+    assert np.array_equal(debayer_array(flipped, bayer_pattern, engine="numba"), expected)
+
+@pytest.mark.parametrize("engine", ["numba", "numpy"])
+@pytest.mark.parametrize("bayer_pattern", BAYER_PATTERNS)
+def test_flip_equivariance(reference, engine, bayer_pattern):
+    mosaic, _ = reference
+    output = debayer_array(mosaic, bayer_pattern, engine=engine)
+    for axis in (0, 1):
+        flipped = np.ascontiguousarray(np.flip(mosaic, axis))
+        assert np.array_equal(debayer_array(flipped, flip_pattern(bayer_pattern, axis), engine=engine), np.flip(output, axis + 1))
+
+def test_numpy_engine_matches_original_kernel(reference):
+    mosaic, output = reference
+    assert max_difference(debayer_array(mosaic, "RGGB", engine="numpy"), output) <= 1
+
+@pytest.mark.parametrize("bayer_pattern", BAYER_PATTERNS)
+def test_colors_of_flat_field(bayer_pattern):
+    """Red, green and blue land in channels 0, 1 and 2 whatever the CFA phase. The two rows and columns
+    at the borders are skipped, as the replicated edge pixels do not follow the Bayer pattern."""
+    values = {"R": 1000, "G": 2000, "B": 3000}
+    tile = np.array([values[color] for color in bayer_pattern], dtype=np.uint16).reshape(2, 2)
+    output = debayer_array(np.tile(tile, (16, 20)), bayer_pattern)[:, 2:-2, 2:-2]
+    for channel, color in enumerate("RGB"):
+        assert max_difference(output[channel], np.full_like(output[channel], values[color])) <= 1 # Truncated to uint16
+
+@pytest.mark.parametrize("engine", ["numba", "numpy"])
+@pytest.mark.parametrize("bayer_pattern", BAYER_PATTERNS)
+def test_float32_precision(engine, bayer_pattern):
+    """The float32 kernel is within 1 ADU of the float64 one, over the full 16-bit range."""
+    mosaic = np.random.default_rng(3).integers(0, 65536, size=(48, 64), dtype=np.uint16)
+    output = debayer_array(mosaic, bayer_pattern, engine=engine, precision="float32")
+    assert output.dtype == np.uint16
+    assert max_difference(output, debayer_array(mosaic, bayer_pattern, engine=engine)) <= 1
+
+@pytest.mark.parametrize("engine", ["numba", "numpy"])
+def test_invalid_precision(reference, engine):
+    mosaic, _ = reference
+    with pytest.raises(ValueError):
+        debayer_array(mosaic, "RGGB", engine=engine, precision="float16")
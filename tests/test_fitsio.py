@@ -0,0 +1,28 @@
+"""Tile-compressed FITS files."""
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from raw2fits import __version__
+from raw2fits.fitsio import COMPRESSION_TYPES, header_template, write_fits_compressed
+
+
+@pytest.mark.parametrize("compression", COMPRESSION_TYPES)
+def test_write_fits_compressed_round_trip(tmp_path, compression):
+    image = np.random.default_rng(0).integers(0, 65536, size=(3, 20, 32), dtype=np.uint16)
+    header = header_template()
+    header["IMAGETYP"] = ("LIGHT", "Type of exposure")
+    path = tmp_path / "image.fits"
+    write_fits_compressed(str(path), header, image, compression=compression)
+    data = fits.getdata(path)
+    assert data.dtype == np.uint16
+    assert np.array_equal(data, image) # Lossless
+    read_header = fits.getheader(path, 1)
+    assert read_header["SWCREATE"] == f"raw2fits v{__version__}"
+    assert read_header["IMAGETYP"] == "LIGHT"
+    with fits.open(path, disable_image_compression=True) as hdul:
+        assert hdul[1].header["ZCMPTYPE"] == compression
+
+def test_write_fits_compressed_rejects_unknown_compression(tmp_path):
+    with pytest.raises(ValueError):
+        write_fits_compressed(str(tmp_path / "image.fits"), header_template(), np.zeros((3, 4, 4), dtype=np.uint16), "ZIP")
@@ -0,0 +1,62 @@
+"""Spans, progress events and sinks of raw2fits.instrument."""
+import io
+import json
+import pickle
+
+import numpy as np
+
+from raw2fits import instrument
+from raw2fits.debayer import debayer_array
+
+
+def test_nested_spans_pass_path_down():
+    recorder = instrument.Recorder()
+    with instrument.sinks(recorder):
+        with instrument.span("convert", "a.dng"):
+            with instrument.span("read") as counts:
+                counts["bytes"] = 10
+                instrument.progress("read", 1, 2)
+            with instrument.span("write", "a.fits"):
+                instrument.progress("write", 2, 2)
+            instrument.progress("convert", 1, 1) # The path of the outer span is restored
+        instrument.progress("other", 0, 1)
+    assert [(span.stage, span.path, span.bytes) for span in recorder.spans] == \
+        [("read", "a.dng", 10), ("write", "a.fits", None), ("convert", "a.dng", None)]
+    assert [event.path for event in recorder.progress] == ["a.dng", "a.fits", "a.dng", None]
+    assert set(recorder.totals()) == {"read", "write", "convert"}
+
+def test_no_events_without_sinks():
+    recorder = instrument.Recorder()
+    assert not instrument.enabled()
+    with instrument.span("read", "a.dng"):
+        instrument.progress("read", 1, 1)
+    with instrument.sinks(recorder):
+        assert instrument.enabled()
+    assert not instrument.enabled()
+    assert recorder.spans == [] and recorder.progress == []
+
+def test_print_sink_survives_pickle():
+    sink = pickle.loads(pickle.dumps(instrument.PrintSink()))
+    sink.file = io.StringIO()
+    sink(instrument.Progress("debayer", None, 8, 16))
+    sink(instrument.Span("debayer", "a.dng", 0.0, 1.5, None, 2e6))
+    assert sink.file.getvalue() == "\rdebayer 8/16\ndebayer a.dng 1.500 s, 2.0 MP\n"
+
+def test_json_lines_sink(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    with instrument.sinks(instrument.JSONLinesSink(str(path))):
+        with instrument.span("read", "a.dng", bytes=10):
+            instrument.progress("read", 1, 1) # Not written unless progress=True
+    (event,) = [json.loads(line) for line in path.read_text().splitlines()]
+    assert (event["event"], event["stage"], event["path"], event["bytes"]) == ("span", "read", "a.dng", 10)
+
+def test_debayer_progress_in_blocks():
+    mosaic = np.random.default_rng(0).integers(0, 65536, size=(70, 64), dtype=np.uint16)
+    expected = debayer_array(mosaic, "RGGB")
+    recorder = instrument.Recorder()
+    with instrument.sinks(recorder):
+        output = debayer_array(mosaic, "RGGB")
+    assert np.array_equal(output, expected)
+    done = [event.done for event in recorder.progress if event.stage == "debayer"]
+    assert len(done) > 1 and done == sorted(set(done)) and done[-1] == 70
+    assert all(event.total == 70 for event in recorder.progress)
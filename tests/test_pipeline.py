@@ -0,0 +1,57 @@
+"""Error handling and bookkeeping of the pipelined conversion."""
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from raw2fits.pipeline import convert_pipelined
+
+
+def run(*args, **kwargs):
+    """Run convert_pipelined in a thread, failing the test instead of hanging if it does not return."""
+    outcome = {}
+    def target():
+        try:
+            outcome["value"] = convert_pipelined(*args, **kwargs)
+        except Exception as e:
+            outcome["error"] = e
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout=60)
+    assert not thread.is_alive(), "convert_pipelined did not return"
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["value"]
+
+@pytest.mark.parametrize("readers, writers, queue_depth", [(1, 1, 1), (2, 2, 1)])
+def test_missing_files_give_errors(tmp_path, readers, writers, queue_depth):
+    paths = [str(tmp_path / f"missing{index}.dng") for index in range(5)] # More files than the queues hold
+    results, stats = run(paths, output_dir=str(tmp_path / "fits"), readers=readers, writers=writers, queue_depth=queue_depth)
+    assert sorted(result.path for result in results) == paths
+    for result in results:
+        assert result.error.startswith("FileNotFoundError") and not result.skipped
+        assert result.output == str(tmp_path / "fits" / os.path.basename(result.path).replace(".dng", ".fits"))
+    assert [stage.name for stage in stats] == ["read", "debayer", "write"]
+    assert stats[0].items == 5 and stats[1].items == stats[2].items == 0
+
+def test_up_to_date_files_are_skipped(tmp_path):
+    raw = tmp_path / "frame.dng"
+    raw.write_bytes(b"")
+    (tmp_path / "frame.fits").write_bytes(b"")
+    os.utime(raw, (1000, 1000))
+    seen = []
+    results, _ = run([str(raw)], callback=seen.append)
+    assert results == seen
+    assert [(result.skipped, result.error) for result in results] == [(True, None)]
+
+def test_corrupt_file_gives_error(tmp_path):
+    raw = tmp_path / "frame.dng"
+    raw.write_bytes(np.zeros(64, dtype=np.uint8).tobytes())
+    (result,), _ = run([str(raw)], overwrite=True)
+    assert result.error is not None
+
+@pytest.mark.parametrize("options", [dict(image_type="FLATS"), dict(readers=0), dict(queue_depth=0)])
+def test_invalid_options(tmp_path, options):
+    with pytest.raises(ValueError):
+        convert_pipelined([], **options)
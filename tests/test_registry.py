@@ -0,0 +1,33 @@
+"""Registration of debayer backends."""
+import pytest
+
+from raw2fits import debayer
+from raw2fits.debayer import output_shape, register_backend
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Restore the registry after a test registers backends."""
+    monkeypatch.setattr(debayer, "_BACKENDS", {method: dict(engines) for method, engines in debayer._BACKENDS.items()})
+    monkeypatch.setattr(debayer, "_SCALES", dict(debayer._SCALES))
+    monkeypatch.setattr(debayer, "_VERSIONS", dict(debayer._VERSIONS))
+
+
+def test_engine_with_another_scale_is_rejected(registry):
+    with pytest.raises(ValueError):
+        register_backend("Superpixel", "custom", "raw2fits.debayer_numpy:debayer_superpixel")
+    assert output_shape((64, 128), "Superpixel") == (3, 32, 64)
+
+def test_engine_with_the_same_scale_is_added(registry):
+    register_backend("Superpixel", "custom", "raw2fits.debayer_numpy:debayer_superpixel", scale=2)
+    assert debayer.backends()["Superpixel"] == ["numpy", "custom"]
+
+def test_only_engine_can_be_replaced_with_another_scale(registry):
+    register_backend("Superpixel", "numpy", "raw2fits.debayer_numpy:debayer_bilinear")
+    assert output_shape((64, 128), "Superpixel") == (3, 64, 128)
+
+def test_version_of_each_engine(registry):
+    register_backend("VNG", "custom", "raw2fits.debayer_numpy:debayer_VNG", version="7")
+    assert debayer.backend_version("VNG", "custom") == "7"
+    assert debayer.backend_version("VNG", "numpy") == "1"
+    assert debayer.backend_version("EdgeAware", "numpy") == debayer.backend_version("EdgeAware") # Falls back to the default engine
@@ -0,0 +1,57 @@
+"""Stacking of FITS frames written by raw2fits, plain and tile-compressed."""
+import numpy as np
+import pytest
+
+from raw2fits.fitsio import header_template, write_fits_compressed, write_fits_strips
+from raw2fits.stack import find_frames, stack_frames
+
+
+def frames(n_frames=3, shape=(3, 21, 30)):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 65536, size=shape, dtype=np.uint16) for _ in range(n_frames)]
+
+def write_frames(directory, images, compress):
+    paths = []
+    for index, image in enumerate(images):
+        path = str(directory / f"frame{index}.fits")
+        if compress:
+            write_fits_compressed(path, header_template(), image)
+        else:
+            write_fits_strips(path, header_template(), image.shape, [(0, image)])
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("precision", ["float64", "float32"])
+def test_stack_matches_mean(tmp_path, compress, precision):
+    """The stored values are offset by BZERO, which is applied to each block of rows as it is read."""
+    images = frames()
+    paths = write_frames(tmp_path, images, compress)
+    stacked = stack_frames(paths, method="mean", precision=precision, chunk_rows=4, workers=2)
+    assert stacked.dtype == np.float32
+    assert np.allclose(stacked, np.mean(images, axis=0), rtol=0, atol=0.01)
+
+def test_stack_mixed_compression(tmp_path):
+    images = frames()
+    paths = write_frames(tmp_path, images[:2], compress=False)
+    (tmp_path / "compressed").mkdir()
+    paths += write_frames(tmp_path / "compressed", images[2:], compress=True)
+    assert np.allclose(stack_frames(paths, method="median", chunk_rows=5), np.median(images, axis=0), rtol=0, atol=0.01)
+
+def test_stack_rejects_invalid_input(tmp_path):
+    paths = write_frames(tmp_path, frames(2), compress=False)
+    write_fits_strips(str(tmp_path / "other.fits"), header_template(), (3, 10, 30), [(0, frames(1, (3, 10, 30))[0])])
+    with pytest.raises(ValueError):
+        stack_frames(paths + [str(tmp_path / "other.fits")])
+    with pytest.raises(ValueError):
+        stack_frames(paths, precision="float16")
+    with pytest.raises(ValueError):
+        stack_frames(paths, method="max")
+    with pytest.raises(ValueError):
+        stack_frames([])
+
+def test_find_frames(tmp_path):
+    paths = write_frames(tmp_path, frames(2), compress=False)
+    (tmp_path / "notes.txt").write_text("")
+    assert find_frames([str(tmp_path)]) == paths
@@ -0,0 +1,80 @@
+"""Strip-by-strip debayering and FITS writing give the same result as the whole-frame path."""
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from raw2fits import __version__
+from raw2fits.debayer import backends, debayer_array, debayer_strips, output_shape
+from raw2fits.fitsio import header_template, write_fits_strips
+
+
+BACKENDS = [(method, engine) for method, engines in backends().items() for engine in engines]
+
+
+def mosaic(height, width, seed=0):
+    return np.random.default_rng(seed).integers(0, 65536, size=(height, width), dtype=np.uint16)
+
+def assemble(strips, shape):
+    output = np.zeros(shape, dtype=np.uint16)
+    for row_start, strip in strips:
+        output[:, row_start:row_start + strip.shape[1]] = strip
+    return output
+
+
+@pytest.mark.parametrize("method, engine", BACKENDS)
+@pytest.mark.parametrize("shape", [(50, 64), (37, 64)]) # The last strip is short, and of odd height for 37 rows
+@pytest.mark.parametrize("strip_rows", [2, 6, 34, 256])
+def test_strips_match_whole_frame(method, engine, shape, strip_rows):
+    bayer_img = mosaic(*shape)
+    whole = debayer_array(bayer_img, "GRBG", method=method, engine=engine)
+    strips = debayer_strips(bayer_img, "GRBG", strip_rows, method=method, engine=engine)
+    assert np.array_equal(assemble(strips, whole.shape), whole)
+    assert np.array_equal(debayer_array(bayer_img, "GRBG", method=method, engine=engine, strip_rows=strip_rows), whole)
+
+@pytest.mark.parametrize("method, engine", BACKENDS)
+def test_out_matches_whole_frame(method, engine):
+    bayer_img = mosaic(50, 64)
+    out = np.empty(output_shape(bayer_img.shape, method), dtype=np.uint16)
+    result = debayer_array(bayer_img, "BGGR", method=method, engine=engine, out=out)
+    assert result is out
+    assert np.array_equal(out, debayer_array(bayer_img, "BGGR", method=method, engine=engine))
+
+@pytest.mark.parametrize("engine", ["numba", "numpy"])
+def test_strips_of_odd_width(engine):
+    bayer_img = mosaic(41, 51)
+    whole = debayer_array(bayer_img, "GBRG", engine=engine)
+    assert np.array_equal(assemble(debayer_strips(bayer_img, "GBRG", 10, engine=engine), whole.shape), whole)
+
+@pytest.mark.parametrize("strip_rows", [0, 1, 7])
+def test_strip_rows_must_be_even(strip_rows):
+    with pytest.raises(ValueError):
+        next(debayer_strips(mosaic(8, 8), "RGGB", strip_rows))
+
+
+@pytest.mark.parametrize("height", [1, 64, 130]) # Fewer, exactly and more rows than a conversion block
+def test_write_fits_strips_matches_astropy(tmp_path, height):
+    """The file is the one astropy writes for an HDU built from the image, as Image.save_fits used to."""
+    image = np.random.default_rng(1).integers(0, 65536, size=(3, height, 45), dtype=np.uint16)
+    hdu = fits.PrimaryHDU(image)
+    hdu.header.comments["NAXIS"] = "Dimensionality"
+    hdu.header.comments["EXTEND"] = "Extensions are permitted"
+    hdu.header["SWCREATE"] = (f"raw2fits v{__version__}", "Software used to create this file")
+    hdu.header["IMAGETYP"] = "LIGHT"
+    hdu.writeto(tmp_path / "astropy.fits")
+    header = header_template()
+    header["IMAGETYP"] = "LIGHT"
+    write_fits_strips(tmp_path / "whole.fits", header, image.shape, [(0, image)])
+    strips = [(row_start, image[:, row_start:row_start + 7]) for row_start in range(0, height, 7)]
+    write_fits_strips(tmp_path / "strips.fits", header, image.shape, strips)
+    expected = (tmp_path / "astropy.fits").read_bytes()
+    assert (tmp_path / "whole.fits").read_bytes() == expected
+    assert (tmp_path / "strips.fits").read_bytes() == expected
+
+@pytest.mark.parametrize("method, engine", BACKENDS)
+def test_streamed_file_matches_whole_frame(tmp_path, method, engine):
+    bayer_img = mosaic(50, 64)
+    image = debayer_array(bayer_img, "RGGB", method=method, engine=engine)
+    write_fits_strips(tmp_path / "whole.fits", header_template(), image.shape, [(0, image)])
+    strips = debayer_strips(bayer_img, "RGGB", 6, method=method, engine=engine)
+    write_fits_strips(tmp_path / "strips.fits", header_template(), output_shape(bayer_img.shape, method), strips)
+    assert (tmp_path / "strips.fits").read_bytes() == (tmp_path / "whole.fits").read_bytes()